@@ -0,0 +1,466 @@
+# benchmarks.py
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import tracemalloc
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+from providers import (
+    FixtureProvider, ReplayProvider, SyntheticProvider, synthetic_universe,
+    get_provider, set_provider, provider_from_spec
+)
+from metrics_cache import MetricsCache, set_metrics_cache
+from finance_data import get_stock_data, extract_metrics
+from fetch_engine import fetch_stock_data_concurrently
+from metrics_table import MetricsTableBuilder
+from evaluations import METRIC_THRESHOLDS, score_metrics_frame, evaluate_metrics
+from exports import WRITERS
+from peer_index import PeerIndex, UNIVERSE
+from snapshot_store import SnapshotStore, set_snapshot_store
+from table_view import TableView
+from screening import Screen, run_screen
+from downsampling import downsample, POINT_BUDGET
+from risk import RiskModel, returns_matrix
+from indicators import compute_indicators, VOLATILITY_WINDOW, BETA_WINDOW, SMA_WINDOWS
+from streamlit_app import color_metrics
+
+def synthetic_metrics(n, seed=0):
+    # Metrics records as returned by finance_data.get_stock_data, built from
+    # the synthetic provider's .info payloads
+    provider = SyntheticProvider(seed=seed)
+    return [(ticker, extract_metrics(provider.load_info(ticker))) for ticker in synthetic_universe(n)]
+
+def percentiles(timings):
+    # Formats p50/p95/p99 of a list of durations in seconds
+    p50, p95, p99 = np.percentile(np.asarray(timings) * 1e3, [50, 95, 99])
+    return f"p50 {p50:8.2f} ms  p95 {p95:8.2f} ms  p99 {p99:8.2f} ms"
+
+def timings_of(fn, *args, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def build_with_concat(rows):
+    # The original one-row-at-a-time pd.concat accumulation
+    data = pd.DataFrame()
+    for ticker, metrics in rows:
+        metrics_row = {'Ticker': ticker}
+        metrics_row.update(metrics.to_dict())
+        data = pd.concat([data, pd.DataFrame([metrics_row])], ignore_index=True)
+    return data
+
+def build_with_builder(rows):
+    builder = MetricsTableBuilder()
+    for ticker, metrics in rows:
+        builder.append(ticker, metrics)
+    return builder.to_frame()
+
+def best_of(fn, *args, repeat=3):
+    return min(timings_of(fn, *args, repeat=repeat))
+
+def list_tickers(n):
+    # Tickers available from the configured provider: every recorded fixture
+    # for a replay provider, otherwise a synthetic universe
+    provider = get_provider()
+    if isinstance(provider, ReplayProvider):
+        info_dir = os.path.join(provider.directory, 'info')
+        return sorted(name[:-len('.json')] for name in os.listdir(info_dir) if name.endswith('.json'))[:n]
+    return synthetic_universe(n)
+
+def bench_fetch(sizes=(100, 1000), latency=0.02, workers=8):
+    # The fetch_data path without the UI: concurrent get_stock_data calls into
+    # the columnar builder, against the configured provider with simulated
+    # network latency and a throwaway metrics cache and snapshot history
+    if isinstance(get_provider(), FixtureProvider):
+        get_provider().latency = latency
+    with tempfile.TemporaryDirectory() as directory:
+        set_metrics_cache(MetricsCache(os.path.join(directory, 'metrics_cache.sqlite')))
+        set_snapshot_store(SnapshotStore(os.path.join(directory, 'snapshots')))
+        tickers = list_tickers(max(sizes))
+        for n in sizes:
+            n = min(n, len(tickers))
+            ticker_latencies = []
+
+            def fetch(ticker):
+                start = time.perf_counter()
+                try:
+                    return get_stock_data(ticker, force_refresh=True)
+                finally:
+                    ticker_latencies.append(time.perf_counter() - start)
+
+            builder = MetricsTableBuilder(capacity=n)
+            start = time.perf_counter()
+            for ticker, result, error in fetch_stock_data_concurrently(tickers[:n], max_workers=workers, fetch=fetch):
+                if error is None:
+                    builder.append(ticker, result)
+            builder.to_frame()
+            total = time.perf_counter() - start
+            print(f"{n:>6} tickers  {n / total:>9.0f} rows/s  per ticker {percentiles(ticker_latencies)}")
+
+def bench_export(sizes=(1000, 10000)):
+    for n in sizes:
+        metrics_df = build_with_builder(synthetic_metrics(n))
+        for extension, writer in WRITERS.items():
+            timings = timings_of(writer, metrics_df, repeat=5)
+            print(f"{n:>6} rows {extension:>8}  {n / np.median(timings):>10.0f} rows/s  {percentiles(timings)}")
+
+def bench_table(sizes=(100, 1000, 2500, 5000, 10000), concat_limit=2500):
+    print(f"{'tickers':>8} {'builder (s)':>12} {'us/row':>8} {'concat (s)':>11} {'us/row':>8}")
+    for n in sizes:
+        rows = synthetic_metrics(n)
+        builder_time = best_of(build_with_builder, rows)
+        line = f"{n:>8} {builder_time:>12.4f} {builder_time / n * 1e6:>8.1f}"
+        # The quadratic path gets slow quickly, so only time it for small tables
+        if n <= concat_limit:
+            concat_time = best_of(build_with_concat, rows, repeat=1)
+            line += f" {concat_time:>11.4f} {concat_time / n * 1e6:>8.1f}"
+        print(line)
+
+def bench_scoring(sizes=(1000, 5000, 50000)):
+    print(f"{'tickers':>8} {'batch (ms)':>11} {'per-row (ms)':>13}")
+    for n in sizes:
+        metrics_df = build_with_builder(synthetic_metrics(n))
+        batch_time = best_of(score_metrics_frame, metrics_df)
+        line = f"{n:>8} {batch_time * 1e3:>11.2f}"
+        # Scoring row by row with the scalar evaluator, for comparison
+        if n <= 5000:
+            rows = metrics_df.to_dict('records')
+            row_time = best_of(lambda: [evaluate_metrics(row) for row in rows], repeat=1)
+            line += f" {row_time * 1e3:>13.2f}"
+        print(line)
+    # Latency of building the explanation for a single displayed row
+    rows = build_with_builder(synthetic_metrics(1000)).to_dict('records')
+    row_latencies = [timings_of(evaluate_metrics, row, repeat=1)[0] for row in rows]
+    print(f"evaluate_metrics per row: {percentiles(row_latencies)}")
+
+def bench_screening(sizes=(1000, 10000, 50000), top=20):
+    # A compiled screen ranked by total score with partial selection, versus
+    # a full sort of the matching rows
+    expression = '"PE Ratio" < 20 and "Return on Equity (%)" > 15'
+    print(f"{'rows':>8} {'compile (ms)':>13} {f'screen top {top} (ms)':>21} {'full sort (ms)':>15}")
+    for n in sizes:
+        metrics_df = build_with_builder(synthetic_metrics(n)).set_index('Ticker')
+        metrics_df['Total Score'] = score_metrics_frame(metrics_df)['Total Score']
+        compile_time = best_of(Screen, expression)
+        screen_time = best_of(run_screen, metrics_df, expression, 'Total Score', top)
+        full_sort = lambda: metrics_df.query('`PE Ratio` < 20 and `Return on Equity (%)` > 15').sort_values(
+            'Total Score', ascending=False).head(top)
+        print(f"{n:>8} {compile_time * 1e3:>13.3f} {screen_time * 1e3:>21.2f} {best_of(full_sort) * 1e3:>15.2f}")
+
+def _color_cell(val, threshold):
+    # Per-cell callback equivalent to the old color_* functions
+    if pd.isnull(val):
+        return ''
+    low = np.inf if threshold.low is None else threshold.low
+    if (val > threshold.high) if threshold.higher_is_better else (val < low):
+        color = 'green'
+    elif low <= val <= threshold.high:
+        color = 'orange'
+    else:
+        color = 'red'
+    return f'background-color: {color}'
+
+def colors_per_cell(metrics_df):
+    return {
+        col: metrics_df[col].map(lambda val: _color_cell(val, METRIC_THRESHOLDS[col]))
+        for col in METRIC_THRESHOLDS
+    }
+
+def render_per_cell(metrics_df):
+    styler = metrics_df.style
+    for col in METRIC_THRESHOLDS:
+        styler = styler.map(_color_cell, subset=[col], threshold=METRIC_THRESHOLDS[col])
+    return styler.to_html()
+
+def render_vectorized(metrics_df):
+    return metrics_df.style.apply(color_metrics, axis=None).to_html()
+
+def bench_styling(sizes=(100, 1000, 5000)):
+    # Colour computation on its own, and the full Styler render to HTML
+    print(f"{'tickers':>8} {'colors (ms)':>12} {'per cell':>9} {'render (ms)':>12} {'per cell':>9}")
+    for n in sizes:
+        metrics_df = build_with_builder(synthetic_metrics(n)).set_index('Ticker')
+        print(
+            f"{n:>8} {best_of(color_metrics, metrics_df) * 1e3:>12.2f}"
+            f" {best_of(colors_per_cell, metrics_df) * 1e3:>9.2f}"
+            f" {best_of(render_vectorized, metrics_df, repeat=1) * 1e3:>12.2f}"
+            f" {best_of(render_per_cell, metrics_df, repeat=1) * 1e3:>9.2f}"
+        )
+
+def render_page(metrics_df, page_size=50):
+    # A new view (first sort included) and one sorted, filtered page rendered
+    view = TableView(metrics_df)
+    rows = view.rows('PE Ratio', descending=True, ranges={'Beta': (0.0, 2.0)})
+    return metrics_df.iloc[view.page(rows, 1, page_size)].style.apply(color_metrics, axis=None).to_html()
+
+def bench_table_view(sizes=(500, 2000, 10000)):
+    # Rendering one sorted and filtered page versus the whole table
+    print(f"{'tickers':>8} {'page (ms)':>10} {'full table (ms)':>16}")
+    for n in sizes:
+        metrics_df = build_with_builder(synthetic_metrics(n)).set_index('Ticker')
+        page_time = best_of(render_page, metrics_df)
+        full_time = best_of(render_vectorized, metrics_df, repeat=1)
+        print(f"{n:>8} {page_time * 1e3:>10.1f} {full_time * 1e3:>16.1f}")
+
+# Startup timings are compared against this file when it exists
+STARTUP_BASELINE = os.path.join('.cache', 'startup_baseline.json')
+STARTUP_TOLERANCE = 0.3  # allowed slowdown before a regression is reported
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import streamlit_app
+print(time.perf_counter() - start)
+"""
+
+# First render runs offline against an empty cache, so it measures the app
+# itself (imports, layout, table and chart code) rather than Yahoo latency
+RENDER_SNIPPET = """
+import os, sys, time, tempfile
+os.environ['AI_FUND_OFFLINE'] = '1'
+os.environ['AI_FUND_CACHE_PATH'] = os.path.join(tempfile.mkdtemp(), 'metrics_cache.sqlite')
+os.environ['AI_FUND_HISTORY_PATH'] = tempfile.mkdtemp()
+os.environ['AI_FUND_SNAPSHOT_PATH'] = tempfile.mkdtemp()
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+AppTest.from_file('streamlit_app.py', default_timeout=120).run()
+print(time.perf_counter() - start)
+"""
+
+def _time_snippet(snippet, repeat):
+    # Runs the snippet in fresh interpreters so every run pays the full import cost
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', snippet], capture_output=True, text=True, check=True)
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    # The fastest run is the least affected by other load on the machine
+    return min(timings)
+
+def bench_startup(repeat=5, record=False):
+    timings = {
+        'import_ms': _time_snippet(IMPORT_SNIPPET, repeat) * 1e3,
+        'first_render_ms': _time_snippet(RENDER_SNIPPET, repeat) * 1e3,
+    }
+    baseline = None
+    if os.path.exists(STARTUP_BASELINE):
+        with open(STARTUP_BASELINE) as f:
+            baseline = json.load(f)
+
+    regressions = []
+    for name, value in timings.items():
+        line = f"{name:>16} {value:>9.1f}"
+        if baseline and name in baseline:
+            change = value / baseline[name] - 1
+            line += f"  (baseline {baseline[name]:.1f}, {change:+.0%})"
+            if change > STARTUP_TOLERANCE:
+                regressions.append(name)
+        print(line)
+
+    if record:
+        os.makedirs(os.path.dirname(STARTUP_BASELINE), exist_ok=True)
+        with open(STARTUP_BASELINE, 'w') as f:
+            json.dump(timings, f, indent=2)
+        print(f"recorded baseline in {STARTUP_BASELINE}")
+    if regressions:
+        print(f"startup regression in: {', '.join(regressions)}")
+        sys.exit(1)
+
+def rank_with_groupby(universe_df, metrics_df, columns):
+    # Recomputing industry percentile ranks over the whole universe, as a
+    # per-render groupby would
+    combined = pd.concat([universe_df, metrics_df], ignore_index=True)
+    ranks = combined.groupby('Industry', observed=True)[columns].rank(pct=True) * 100
+    return ranks.iloc[len(universe_df):].to_numpy()
+
+def bench_peers(universe=10000, sizes=(17, 1000, 5000)):
+    # Percentile ranks from the incrementally maintained peer index versus a
+    # groupby over the universe
+    rows = synthetic_metrics(universe)
+    universe_df = build_with_builder(rows)
+    columns = list(METRIC_THRESHOLDS)
+    index = PeerIndex()
+    start = time.perf_counter()
+    for ticker, record in rows:
+        index.update(ticker, record)
+    index.stats(UNIVERSE, UNIVERSE)
+    print(f"index {universe} tickers: {(time.perf_counter() - start) * 1e3:.1f} ms")
+    # One changed ticker only recomputes its own groups
+    ticker, record = rows[0]
+    update_time = best_of(lambda: (index.update(ticker, record), index.stats(UNIVERSE, UNIVERSE)))
+    print(f"update one ticker: {update_time * 1e3:.2f} ms")
+    print(f"{'rows':>8} {'index (ms)':>11} {'groupby (ms)':>13}")
+    for n in sizes:
+        metrics_df = universe_df.iloc[:n]
+        index_time = best_of(index.percentile_ranks, metrics_df, columns)
+        groupby_time = best_of(rank_with_groupby, universe_df, metrics_df, columns)
+        print(f"{n:>8} {index_time * 1e3:>11.2f} {groupby_time * 1e3:>13.2f}")
+
+def bench_snapshots(tickers=2000, days=60, query_tickers=2, query_days=14):
+    # Trend queries against a store holding one snapshot per ticker per day:
+    # a few tickers over a short range versus a full scan
+    rows = synthetic_metrics(tickers)
+    now = time.time()
+    with tempfile.TemporaryDirectory() as root:
+        store = SnapshotStore(root, flush_rows=float('inf'))
+        start = time.perf_counter()
+        for day in range(days):
+            for ticker, record in rows:
+                store.append(ticker, record, fetched_at=now - (days - day) * 86400)
+        store.flush()
+        print(f"write {days} days x {tickers} tickers: {(time.perf_counter() - start) * 1e3:.1f} ms")
+        selected = [ticker for ticker, _ in rows[:query_tickers]]
+        range_start = pd.Timestamp(now - query_days * 86400, unit='s')
+        query = lambda: store.query(selected, ['PE Ratio'], start=range_start)
+        print(f"{query_tickers} tickers, 1 metric, {query_days} days ({len(query())} rows): {percentiles(timings_of(query))}")
+        full = lambda: store.query()
+        print(f"full scan ({len(full())} rows): {percentiles(timings_of(full))}")
+
+def indicators_per_ticker(close, benchmark):
+    # One pandas rolling computation per ticker, for comparison
+    benchmark_returns = np.log(benchmark).diff()
+    for ticker in close.columns:
+        series = close[ticker]
+        returns = np.log(series).diff()
+        returns.rolling(VOLATILITY_WINDOW).std()
+        for window in SMA_WINDOWS:
+            series.rolling(window).mean()
+        returns.rolling(BETA_WINDOW).cov(benchmark_returns) / benchmark_returns.rolling(BETA_WINDOW).var()
+        (series / series.cummax() - 1).min()
+
+def bench_indicators(sizes=(17, 500, 5000), days=504):
+    # Indicators for every ticker of a two-year close matrix at once versus a
+    # pandas loop over tickers
+    rng = np.random.default_rng(0)
+    print(f"{'tickers':>8} {'matrix (ms)':>12} {'per ticker (ms)':>16}")
+    for n in sizes:
+        close = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.02, (days, n)), axis=0)))
+        benchmark = pd.Series(100 * np.exp(np.cumsum(rng.normal(0, 0.01, days))))
+        matrix_time = best_of(compute_indicators, close, benchmark)
+        loop_time = best_of(indicators_per_ticker, close, benchmark, repeat=1)
+        print(f"{n:>8} {matrix_time * 1e3:>12.1f} {loop_time * 1e3:>16.1f}")
+
+def figure_bytes(series):
+    import plotly.express as px
+
+    return len(px.line(x=series.index, y=series.to_numpy()).to_json())
+
+def bench_downsampling(sizes=(2600, 100000, 1000000), budget=POINT_BUDGET):
+    # Min/max bucketing of a close series to the chart's point budget, and
+    # the size of the figure sent to the browser with and without it
+    rng = np.random.default_rng(0)
+    print(f"{'points':>8} {'downsample (ms)':>16} {'figure (KB)':>12} {'full figure (KB)':>17}")
+    for n in sizes:
+        index = pd.date_range('2000-01-03', periods=n, freq='min')
+        close = pd.Series(100 * np.exp(np.cumsum(rng.normal(0, 0.001, n))), index=index)
+        downsample_time = best_of(downsample, close, budget)
+        print(f"{n:>8} {downsample_time * 1e3:>16.2f} {figure_bytes(downsample(close, budget)) / 1e3:>12.0f}"
+              f" {figure_bytes(close) / 1e3:>17.0f}")
+
+def bench_risk(sizes=(50, 500, 2000), days=252):
+    # Adding or removing one ticker from a covariance model versus building
+    # it again, including the shrinkage and a portfolio evaluation
+    rng = np.random.default_rng(0)
+    print(f"{'tickers':>8} {'build (ms)':>11} {'add one (ms)':>13} {'remove one (ms)':>16}")
+    for n in sizes:
+        close = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.02, (days + 1, n)), axis=0)))
+        returns = returns_matrix(close)
+        weights = dict.fromkeys(range(n), 1.0)
+
+        def build():
+            model = RiskModel(close.index)
+            model.add_many(list(range(n)), returns)
+            return model.portfolio(weights)
+
+        # Capacity for the added ticker is reserved, as after earlier growth
+        model = RiskModel(close.index, capacity=n)
+        model.add_many(list(range(n - 1)), returns[:, :-1])
+
+        start = time.perf_counter()
+        model.add(n - 1, returns[:, -1])
+        model.portfolio(weights)
+        add_time = time.perf_counter() - start
+        start = time.perf_counter()
+        model.remove(n - 1)
+        model.portfolio(weights)
+        remove_time = time.perf_counter() - start
+        print(f"{n:>8} {best_of(build) * 1e3:>11.2f} {add_time * 1e3:>13.2f} {remove_time * 1e3:>16.2f}")
+
+def retained_bytes(build):
+    # Bytes still allocated after build() returns, measured with tracemalloc
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del kept
+    return after - before
+
+def bench_memory(n=10000):
+    # Per-ticker memory of what a fetch keeps around: the .info payload that a
+    # yf.Ticker caches, the old metrics dict, the MetricsRecord that replaced
+    # both, and a row of the final table
+    provider = get_provider()
+    tickers = list_tickers(n)
+    n = len(tickers)
+    infos = [provider.ticker(ticker).info for ticker in tickers]
+    print(f"{n} tickers, {np.mean([len(info) for info in infos]):.0f} fields per .info payload")
+    info_bytes = retained_bytes(lambda: [json.loads(json.dumps(info)) for info in infos])
+    dict_bytes = retained_bytes(lambda: [extract_metrics(info).to_dict() for info in infos])
+    record_bytes = retained_bytes(lambda: [extract_metrics(info) for info in infos])
+    records = [extract_metrics(info) for info in infos]
+    builder = MetricsTableBuilder(capacity=n)
+    builder.extend(tickers, records)
+    table_bytes = builder.to_frame().memory_usage(deep=True).sum()
+    print(f"{'.info payload':>16} {info_bytes / n:>8.0f} bytes/ticker")
+    print(f"{'metrics dict':>16} {dict_bytes / n:>8.0f} bytes/ticker")
+    print(f"{'MetricsRecord':>16} {record_bytes / n:>8.0f} bytes/ticker")
+    print(f"{'table row':>16} {table_bytes / n:>8.0f} bytes/ticker")
+    print(f"builder append {best_of(build_with_builder, list(zip(tickers, records))) * 1e3:.1f} ms, "
+          f"extend {best_of(lambda: MetricsTableBuilder(capacity=n).extend(tickers, records)) * 1e3:.1f} ms")
+
+BENCHMARKS = {
+    'table': bench_table,
+    'scoring': bench_scoring,
+    'screening': bench_screening,
+    'styling': bench_styling,
+    'table_view': bench_table_view,
+    'fetch': bench_fetch,
+    'export': bench_export,
+    'startup': bench_startup,
+    'memory': bench_memory,
+    'peers': bench_peers,
+    'snapshots': bench_snapshots,
+    'indicators': bench_indicators,
+    'downsampling': bench_downsampling,
+    'risk': bench_risk,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the performance benchmarks.")
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--record', action='store_true', help="store the startup timings as the new baseline")
+    parser.add_argument('--provider', default='synthetic',
+                        help="data provider for the fetch and memory benchmarks, e.g. synthetic or replay:<fixtures dir>")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    set_provider(provider_from_spec(args.provider))
+    for name in args.names or list(BENCHMARKS):
+        print(f"== {name} ==")
+        if name == 'startup':
+            bench_startup(record=args.record)
+        else:
+            BENCHMARKS[name]()
@@ -0,0 +1,101 @@
+# downsampling.py
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from price_history import get_price_history_store, period_start
+from instrumentation import span, inc
+
+# Points per line sent to the browser, overridable through an environment variable
+POINT_BUDGET = int(os.environ.get('AI_FUND_CHART_POINTS', 2000))
+# Downsampled series kept per process
+MEMO_SIZE = 256
+
+# Chart ranges and the bar intervals offered for them. Yahoo only serves
+# intraday bars for recent periods: minute bars for the last 60 days and
+# hourly bars for the last two years.
+CHART_PERIODS = {
+    '5d': "5 days",
+    '1mo': "1 month",
+    '6mo': "6 months",
+    '1y': "1 year",
+    '2y': "2 years",
+    '5y': "5 years",
+    '10y': "10 years",
+    'max': "Full history",
+}
+CHART_INTERVALS = {
+    '5m': ("5 minutes", ('5d', '1mo')),
+    '1h': ("1 hour", ('5d', '1mo', '6mo', '1y', '2y')),
+    '1d': ("1 day", tuple(CHART_PERIODS)),
+    '1wk': ("1 week", ('6mo', '1y', '2y', '5y', '10y', 'max')),
+}
+
+def chart_intervals(period):
+    return [interval for interval, (label, periods) in CHART_INTERVALS.items() if period in periods]
+
+def _first_positions(mask, buckets):
+    # First position where mask holds in each bucket
+    positions = np.flatnonzero(mask)
+    _, first = np.unique(buckets[positions], return_index=True)
+    return positions[first]
+
+def minmax_indices(values, budget):
+    # Positions of at most `budget` points of a series that draw the same
+    # line at chart resolution: the series is cut into budget/2 equal
+    # buckets and the lowest and highest point of each is kept, with the
+    # first and last point, so no peak or trough is lost. Vectorized with
+    # reduceat over the bucket boundaries. values must not contain NaN.
+    n = len(values)
+    if n <= budget:
+        return np.arange(n)
+    count = max(1, (budget - 2) // 2)
+    starts = np.linspace(0, n, count + 1).astype(np.intp)[:-1]
+    buckets = np.repeat(np.arange(count), np.diff(np.append(starts, n)))
+    lows = np.minimum.reduceat(values, starts)
+    highs = np.maximum.reduceat(values, starts)
+    return np.unique(np.concatenate([
+        [0, n - 1],
+        _first_positions(values == lows[buckets], buckets),
+        _first_positions(values == highs[buckets], buckets),
+    ]))
+
+def downsample(series, budget=POINT_BUDGET):
+    series = series.dropna()
+    return series.iloc[minmax_indices(series.to_numpy(dtype=np.float64), budget)]
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+def downsampled_closes(tickers, period='1y', interval='1d', budget=POINT_BUDGET):
+    # Returns {ticker: close series} over the period, each cut to the point
+    # budget. Stale tickers are updated first with batched downloads; each
+    # downsampled series is memoized per ticker, range and budget until that
+    # ticker's stored bars change.
+    tickers = list(dict.fromkeys(tickers))
+    store = get_price_history_store()
+    store.try_update_many(tickers, period=period, interval=interval)
+    start = period_start(period)
+    closes = {}
+    for ticker in tickers:
+        key = (ticker, period, interval, budget, store.ticker_version(ticker, interval))
+        with _memo_lock:
+            if key in _memo:
+                _memo.move_to_end(key)
+                closes[ticker] = _memo[key]
+                inc('downsample_memo_hits')
+                continue
+        with span('downsample', interval=interval):
+            close = store.read(ticker, start=start, interval=interval)['Close']
+            series = downsample(close, budget)
+        inc('downsample_points', len(close), kept='all')
+        inc('downsample_points', len(series), kept='plotted')
+        with _memo_lock:
+            _memo[key] = series
+            while len(_memo) > MEMO_SIZE:
+                _memo.popitem(last=False)
+        closes[ticker] = series
+    return closes
@@ -1,136 +1,228 @@
 # evaluations.py
 
-def evaluate_pe_ratio(pe):
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Threshold registry shared by the scorer and the table colouring.
+# Lower-is-better metrics are green below `low`, orange between `low` and `high`
+# (inclusive) and red above `high`; higher-is-better metrics are the mirror image.
+# A `low` of None means the metric has no orange band.
+MetricThreshold = namedtuple('MetricThreshold', ['label', 'higher_is_better', 'low', 'high'])
+
+METRIC_THRESHOLDS = {
+    'PE Ratio': MetricThreshold('PE Ratio', False, 20, 25),
+    'PEG Ratio': MetricThreshold('PEG Ratio', False, 1, 1.5),
+    'Price-to-Sales Ratio': MetricThreshold('Price-to-Sales Ratio', False, 1, 3),
+    'Forward PE': MetricThreshold('Forward PE', False, 20, 25),
+    'Price-to-Book Ratio': MetricThreshold('Price-to-Book Ratio', False, 1, 3),
+    'EV/EBITDA Ratio': MetricThreshold('EV/EBITDA Ratio', False, 10, 14),
+    'Dividend Yield (%)': MetricThreshold('Dividend Yield', True, 1, 3),
+    'Return on Equity (%)': MetricThreshold('Return on Equity', True, 10, 15),
+    'Earnings Per Share ($)': MetricThreshold('Earnings Per Share', True, None, 0),
+    'Debt-to-Equity Ratio': MetricThreshold('Debt-to-Equity', False, 1, 2),
+    'Profit Margin (%)': MetricThreshold('Profit Margin', True, 10, 20),
+    'Beta': MetricThreshold('Beta', False, 1, 1.5),
+}
+
+# Metrics that make up the valuation score, in display order
+SCORED_METRICS = [
+    'PE Ratio',
+    'PEG Ratio',
+    'Price-to-Sales Ratio',
+    'Return on Equity (%)',
+    'Debt-to-Equity Ratio',
+    'Profit Margin (%)',
+    'EV/EBITDA Ratio'
+]
+
+# Bands returned by metric_bands, and the score and colour of each
+NOT_AVAILABLE, GREEN, ORANGE, RED = 0, 1, 2, 3
+BAND_SCORES = np.array([0, 1, 0, -1])
+BAND_COLORS = np.array(['black', 'green', 'orange', 'red'])
+
+# Percentile cut-offs for peer-relative bands, measured from the favourable end
+PEER_GREEN = 100 / 3
+PEER_ORANGE = 200 / 3
+PEER_THIRDS = {GREEN: "best third", ORANGE: "middle third", RED: "worst third"}
+
+# Explanation messages per band: (green, orange, red, not available)
+METRIC_MESSAGES = {
+    'PE Ratio': (
+        "Undervalued based on PE Ratio (<{low:g}). PE Ratio = {value}.",
+        "Fairly valued based on PE Ratio ({low:g} - {high:g}). PE Ratio = {value}.",
+        "Overvalued based on PE Ratio (>{high:g}). PE Ratio = {value}.",
+        "PE ratio is not available for comparison."
+    ),
+    'PEG Ratio': (
+        "Undervalued based on PEG Ratio (<{low:g}). PEG Ratio = {value}.",
+        "Fairly valued based on PEG Ratio ({low:g} - {high:g}). PEG Ratio = {value}.",
+        "Overvalued based on PEG Ratio (>{high:g}). PEG Ratio = {value}.",
+        "PEG ratio is not available for comparison."
+    ),
+    'Price-to-Sales Ratio': (
+        "Undervalued based on Price-to-Sales Ratio (<{low:g}). Price-to-Sales Ratio = {value}.",
+        "Fairly valued based on Price-to-Sales Ratio ({low:g} - {high:g}). Price-to-Sales Ratio = {value}.",
+        "Overvalued based on Price-to-Sales Ratio (>{high:g}). Price-to-Sales Ratio = {value}.",
+        "Price-to-Sales ratio is not available."
+    ),
+    'Return on Equity (%)': (
+        "High Return on Equity (>{high:g}%). ROE = {value}%.",
+        "Moderate Return on Equity ({low:g}% - {high:g}%). ROE = {value}%.",
+        "Low Return on Equity (<{low:g}%). ROE = {value}%.",
+        "Return on Equity is not available."
+    ),
+    'Debt-to-Equity Ratio': (
+        "Low Debt-to-Equity ratio (<{low:g}). Debt-to-Equity = {value}.",
+        "Moderate Debt-to-Equity ratio ({low:g} - {high:g}). Debt-to-Equity = {value}.",
+        "High Debt-to-Equity ratio (>{high:g}). Debt-to-Equity = {value}.",
+        "Debt-to-Equity ratio is not available."
+    ),
+    'Profit Margin (%)': (
+        "High Profit Margin (>{high:g}%). Profit Margin = {value}%.",
+        "Moderate Profit Margin ({low:g}% - {high:g}%). Profit Margin = {value}%.",
+        "Low Profit Margin (<{low:g}%). Profit Margin = {value}%.",
+        "Profit Margin is not available."
+    ),
+    'EV/EBITDA Ratio': (
+        "Potentially undervalued based on EV/EBITDA (<{low:g}). EV/EBITDA = {value}.",
+        "Fairly valued based on EV/EBITDA ({low:g} - {high:g}). EV/EBITDA = {value}.",
+        "Potentially overvalued based on EV/EBITDA (>{high:g}). EV/EBITDA = {value}.",
+        "EV/EBITDA ratio is not available."
+    ),
+}
+
+def _threshold_arrays(columns):
+    thresholds = [METRIC_THRESHOLDS[col] for col in columns]
+    higher = np.array([t.higher_is_better for t in thresholds])
+    low = np.array([np.inf if t.low is None else t.low for t in thresholds], dtype=float)
+    high = np.array([t.high for t in thresholds], dtype=float)
+    return higher, low, high
+
+def metric_bands(values, columns):
+    # Classifies a (rows x columns) float array into bands in a single pass,
+    # broadcasting each column's thresholds across the rows
+    values = np.asarray(values, dtype=float)
+    higher, low, high = _threshold_arrays(columns)
+    with np.errstate(invalid='ignore'):
+        green = np.where(higher, values > high, values < low)
+        orange = (values >= low) & (values <= high)
+    return np.select(
+        [np.isnan(values), green, orange],
+        [NOT_AVAILABLE, GREEN, ORANGE],
+        default=RED
+    )
+
+def peer_bands(ranks, columns):
+    # Classifies percentile ranks within peer groups (0-100) into bands: the
+    # best third of peers is green, the middle third orange, the worst red
+    ranks = np.asarray(ranks, dtype=float)
+    higher = np.array([METRIC_THRESHOLDS[col].higher_is_better for col in columns])
+    with np.errstate(invalid='ignore'):
+        standing = np.where(higher, 100 - ranks, ranks)
+    return np.select(
+        [np.isnan(standing), standing <= PEER_GREEN, standing <= PEER_ORANGE],
+        [NOT_AVAILABLE, GREEN, ORANGE],
+        default=RED
+    )
+
+def score_metrics_frame(metrics_df, columns=SCORED_METRICS, bands=None):
+    # Scores every row of a metrics DataFrame at once. Returns a DataFrame with
+    # '<metric> Score' and '<metric> Color' columns plus the 'Total Score'.
+    # bands (rows x columns) overrides the fixed thresholds, e.g. with peer_bands.
+    if bands is None:
+        bands = metric_bands(metrics_df[columns].to_numpy(dtype=float, na_value=np.nan), columns)
+    scores = BAND_SCORES[bands]
+    colors = BAND_COLORS[bands]
+    result = {}
+    for i, col in enumerate(columns):
+        result[f'{col} Score'] = scores[:, i]
+        result[f'{col} Color'] = colors[:, i]
+    result['Total Score'] = scores.sum(axis=1)
+    return pd.DataFrame(result, index=metrics_df.index)
+
+def _to_float(value):
+    if isinstance(value, str):
+        value = value.replace('%', '')
     try:
-        pe_value = float(pe)
-    except:
-        return ("PE ratio is not available for comparison.", 0, "black")
-    # Define fixed ranges for PE Ratio
-    if pe_value < 20:
-        return (f"Undervalued based on PE Ratio (<20). PE Ratio = {pe_value}.", 1, "green")
-    elif 20 <= pe_value <= 25:
-        return (f"Fairly valued based on PE Ratio (20 - 25). PE Ratio = {pe_value}.", 0, "orange")
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def explain_metric(column, value):
+    # Builds the (message, score, color) evaluation for a single value; only
+    # needed when a row is actually displayed
+    value = _to_float(value)
+    band = metric_bands([[value]], [column])[0, 0]
+    threshold = METRIC_THRESHOLDS[column]
+    green_message, orange_message, red_message, missing_message = METRIC_MESSAGES[column]
+    message = {
+        NOT_AVAILABLE: missing_message,
+        GREEN: green_message,
+        ORANGE: orange_message,
+        RED: red_message,
+    }[band]
+    message = message.format(value=value, low=threshold.low, high=threshold.high)
+    return (message, int(BAND_SCORES[band]), str(BAND_COLORS[band]))
+
+def explain_peer_metric(column, value, rank):
+    # Peer-relative counterpart of explain_metric, from the value's percentile
+    # rank (0-100) within its peer group as given by PeerIndex.percentile_ranks
+    value = _to_float(value)
+    band = peer_bands([[rank]], [column])[0, 0]
+    if np.isnan(value):
+        message = METRIC_MESSAGES[column][3]
+    elif band == NOT_AVAILABLE:
+        message = f"{column} = {value}; too few peers cached to compare against."
     else:
-        return (f"Overvalued based on PE Ratio (>25). PE Ratio = {pe_value}.", -1, "red")
+        beaten = rank if METRIC_THRESHOLDS[column].higher_is_better else 100 - rank
+        message = f"{column} = {value}, better than {beaten:.0f}% of peers ({PEER_THIRDS[band]})."
+    return (message, int(BAND_SCORES[band]), str(BAND_COLORS[band]))
+
+def evaluate_pe_ratio(pe):
+    return explain_metric('PE Ratio', pe)
 
 def evaluate_peg_ratio(peg):
-    try:
-        peg_value = float(peg)
-    except:
-        return ("PEG ratio is not available for comparison.", 0, "black")
-    # Define fixed ranges for PEG Ratio
-    if peg_value < 1:
-        return (f"Undervalued based on PEG Ratio (<1). PEG Ratio = {peg_value}.", 1, "green")
-    elif 1 <= peg_value <= 1.5:
-        return (f"Fairly valued based on PEG Ratio (1 - 1.5). PEG Ratio = {peg_value}.", 0, "orange")
-    else:
-        return (f"Overvalued based on PEG Ratio (>1.5). PEG Ratio = {peg_value}.", -1, "red")
+    return explain_metric('PEG Ratio', peg)
 
 def evaluate_price_to_sales(ps_ratio):
-    try:
-        ps_value = float(ps_ratio)
-    except:
-        return ("Price-to-Sales ratio is not available.", 0, "black")
-    # Define expected ranges for Price-to-Sales Ratio
-    # These ranges can vary by industry; adjust as necessary
-    if ps_value < 1:
-        return (f"Undervalued based on Price-to-Sales Ratio (<1). Price-to-Sales Ratio = {ps_value}.", 1, "green")
-    elif 1 <= ps_value <= 3:
-        return (f"Fairly valued based on Price-to-Sales Ratio (1 - 3). Price-to-Sales Ratio = {ps_value}.", 0, "orange")
-    else:
-        return (f"Overvalued based on Price-to-Sales Ratio (>3). Price-to-Sales Ratio = {ps_value}.", -1, "red")
+    return explain_metric('Price-to-Sales Ratio', ps_ratio)
 
 def evaluate_roe(roe_value):
-    try:
-        roe_value = float(roe_value.replace('%', ''))
-    except:
-        return ("Return on Equity is not available.", 0, "black")
-    if roe_value > 15:
-        return (f"High Return on Equity (>15%). ROE = {roe_value}%.", 1, "green")
-    elif 10 <= roe_value <= 15:
-        return (f"Moderate Return on Equity (10% - 15%). ROE = {roe_value}%.", 0, "orange")
-    else:
-        return (f"Low Return on Equity (<10%). ROE = {roe_value}%.", -1, "red")
+    return explain_metric('Return on Equity (%)', roe_value)
 
 def evaluate_debt_to_equity(de_ratio):
-    try:
-        de_value = float(de_ratio)
-    except:
-        return ("Debt-to-Equity ratio is not available.", 0, "black")
-    if de_value < 1:
-        return (f"Low Debt-to-Equity ratio (<1). Debt-to-Equity = {de_value}.", 1, "green")
-    elif 1 <= de_value <= 2:
-        return (f"Moderate Debt-to-Equity ratio (1 - 2). Debt-to-Equity = {de_value}.", 0, "orange")
-    else:
-        return (f"High Debt-to-Equity ratio (>2). Debt-to-Equity = {de_value}.", -1, "red")
+    return explain_metric('Debt-to-Equity Ratio', de_ratio)
 
 def evaluate_profit_margin(pm):
-    try:
-        pm_value = float(pm.replace('%', ''))
-    except:
-        return ("Profit Margin is not available.", 0, "black")
-    if pm_value > 20:
-        return (f"High Profit Margin (>20%). Profit Margin = {pm_value}%.", 1, "green")
-    elif 10 <= pm_value <= 20:
-        return (f"Moderate Profit Margin (10% - 20%). Profit Margin = {pm_value}%.", 0, "orange")
-    else:
-        return (f"Low Profit Margin (<10%). Profit Margin = {pm_value}%.", -1, "red")
+    return explain_metric('Profit Margin (%)', pm)
 
 def evaluate_ev_ebitda(ev_ebitda):
-    try:
-        ev_ebitda_value = float(ev_ebitda)
-    except:
-        return ("EV/EBITDA ratio is not available.", 0, "black")
-    if ev_ebitda_value < 10:
-        return (f"Potentially undervalued based on EV/EBITDA (<10). EV/EBITDA = {ev_ebitda_value}.", 1, "green")
-    elif 10 <= ev_ebitda_value <= 14:
-        return (f"Fairly valued based on EV/EBITDA (10 - 14). EV/EBITDA = {ev_ebitda_value}.", 0, "orange")
-    else:
-        return (f"Potentially overvalued based on EV/EBITDA (>14). EV/EBITDA = {ev_ebitda_value}.", -1, "red")
+    return explain_metric('EV/EBITDA Ratio', ev_ebitda)
 
-def evaluate_metrics(metrics):
-    pe_message, pe_score, pe_color = evaluate_pe_ratio(metrics['PE Ratio'])
-    peg_message, peg_score, peg_color = evaluate_peg_ratio(metrics['PEG Ratio'])           # Added PEG Ratio
-    ps_message, ps_score, ps_color = evaluate_price_to_sales(metrics['Price-to-Sales Ratio'])  # Moved PS Ratio to third position
-    roe_message, roe_score, roe_color = evaluate_roe(metrics['Return on Equity (%)'])
-    de_message, de_score, de_color = evaluate_debt_to_equity(metrics['Debt-to-Equity Ratio'])
-    pm_message, pm_score, pm_color = evaluate_profit_margin(metrics['Profit Margin (%)'])
-    ev_message, ev_score, ev_color = evaluate_ev_ebitda(metrics['EV/EBITDA Ratio'])
-
-    total_score = pe_score + peg_score + ps_score + roe_score + de_score + pm_score + ev_score
-
-    # Determine overall valuation without color
-    # As per your instruction, the overall evaluation statement is removed
+def evaluate_metrics(metrics, ranks=None):
+    # Create evaluation dictionary with color-coded messages for one ticker.
+    # With ranks (percentile ranks among peers, in SCORED_METRICS order) the
+    # messages are peer-relative, matching scores from peer_bands.
+    if ranks is None:
+        results = [explain_metric(col, metrics[col]) for col in SCORED_METRICS]
+    else:
+        results = [explain_peer_metric(col, metrics[col], rank) for col, rank in zip(SCORED_METRICS, ranks)]
 
-    # Create evaluation dictionary with color-coded messages
     evaluations = {
         'Metric': [
             'PE Ratio',
-            'PEG Ratio',                   # Added PEG Ratio
-            'Price-to-Sales Ratio',        # Moved PS Ratio to third position
+            'PEG Ratio',
+            'Price-to-Sales Ratio',
             'Return on Equity',
             'Debt-to-Equity',
             'Profit Margin',
             'EV/EBITDA Ratio'
         ],
-        'Evaluation': [
-            pe_message,
-            peg_message,                   # Added PEG Ratio
-            ps_message,                    # Moved PS Ratio to third position
-            roe_message,
-            de_message,
-            pm_message,
-            ev_message
-        ],
-        'Color': [
-            pe_color,
-            peg_color,                     # Added PEG Ratio
-            ps_color,                      # Moved PS Ratio to third position
-            roe_color,
-            de_color,
-            pm_color,
-            ev_color
-        ]
+        'Evaluation': [message for message, score, color in results],
+        'Color': [color for message, score, color in results],
+        'Score': [score for message, score, color in results]
     }
 
-    return evaluations, None  # Removed overall_evaluation
\ No newline at end of file
+    return evaluations, None  # Removed overall_evaluation
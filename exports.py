@@ -0,0 +1,93 @@
+# exports.py
+
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span, inc
+
+# Export formats offered in the app: label -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    'Excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'Arrow IPC': ('arrow', 'application/vnd.apache.arrow.file'),
+}
+
+# Number of generated exports kept in memory
+MEMO_SIZE = 16
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+def frame_hash(df):
+    # Content hash of a DataFrame: values, index, column names and dtypes
+    digest = hashlib.sha1()
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode())
+    return digest.hexdigest()
+
+def to_excel(df):
+    # Writes rows in order with xlsxwriter's constant-memory mode, which flushes
+    # each row to disk once the next one starts instead of holding every cell
+    import xlsxwriter
+
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Stock Metrics')
+    header_format = workbook.add_format({'bold': True, 'border': 1})
+    worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+    for row_number, row in enumerate(df.itertuples(index=False), start=1):
+        for col_number, value in enumerate(row):
+            if isinstance(value, (float, np.floating)) and not np.isfinite(value):
+                continue
+            if isinstance(value, np.integer):
+                value = int(value)
+            worksheet.write(row_number, col_number, value)
+    workbook.close()
+    return output.getvalue()
+
+def to_csv(df):
+    return df.to_csv(index=False).encode('utf-8')
+
+def to_parquet(df):
+    output = BytesIO()
+    df.to_parquet(output, index=False)
+    return output.getvalue()
+
+def to_arrow(df):
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+WRITERS = {
+    'xlsx': to_excel,
+    'csv': to_csv,
+    'parquet': to_parquet,
+    'arrow': to_arrow,
+}
+
+def export_bytes(df, extension, content_hash=None):
+    # Generates the export on demand and memoizes it on the frame's content hash
+    key = (content_hash or frame_hash(df), extension)
+    with _memo_lock:
+        if key in _memo:
+            _memo.move_to_end(key)
+            inc('export_memo_hits', format=extension)
+            return _memo[key]
+    with span('export', format=extension):
+        data = WRITERS[extension](df)
+    inc('export_bytes', len(data), format=extension)
+    with _memo_lock:
+        _memo[key] = data
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return data
@@ -0,0 +1,85 @@
+# fetch_engine.py
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from finance_data import get_stock_data
+from request_scheduler import set_wait_listener
+
+# Default concurrency settings for a refresh
+MAX_WORKERS = 8
+TICKER_TIMEOUT = 20  # seconds a single ticker may run, not counting rate limit and backoff waits
+
+def fetch_stock_data_concurrently(tickers, max_workers=MAX_WORKERS, timeout=TICKER_TIMEOUT, fetch=get_stock_data):
+    # Runs fetch(ticker) for every ticker with at most max_workers calls in
+    # flight and yields (ticker, result, error) tuples in completion order, so
+    # callers can show partial results while the rest of the batch is still
+    # running. A ticker that runs longer than `timeout`, not counting time
+    # spent waiting for the request scheduler's rate limit or retry backoff,
+    # is reported as a TimeoutError and is no longer waited on. Its thread
+    # cannot be stopped, so it stops counting against max_workers and the
+    # next ticker starts on a new thread instead of queueing behind the hung
+    # call.
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return
+
+    # ticker -> (seconds counted so far, time counting resumed or None while waiting)
+    clocks = {}
+    clocks_lock = threading.Lock()
+
+    def run(ticker):
+        def on_wait(waiting):
+            now = time.monotonic()
+            with clocks_lock:
+                counted, since = clocks[ticker]
+                if waiting and since is not None:
+                    clocks[ticker] = (counted + now - since, None)
+                elif not waiting and since is None:
+                    clocks[ticker] = (counted, now)
+
+        with clocks_lock:
+            clocks[ticker] = (0.0, time.monotonic())
+        set_wait_listener(on_wait)
+        try:
+            return fetch(ticker)
+        finally:
+            set_wait_listener(None)
+
+    def elapsed(ticker, now):
+        counted, since = clocks[ticker]
+        return counted + (now - since if since is not None else 0.0)
+
+    # Threads are only created as calls are submitted; the extra room is for
+    # threads left behind by timed-out calls
+    executor = ThreadPoolExecutor(max_workers=len(tickers))
+    queued = deque(tickers)
+    pending = {}
+    try:
+        while queued or pending:
+            while queued and len(pending) < max(1, max_workers):
+                ticker = queued.popleft()
+                pending[executor.submit(run, ticker)] = ticker
+            done, _ = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            for future in done:
+                ticker = pending.pop(future)
+                try:
+                    yield ticker, future.result(), None
+                except Exception as e:
+                    yield ticker, None, e
+
+            # Give up on tickers that have been running past their deadline
+            now = time.monotonic()
+            with clocks_lock:
+                expired = [
+                    future for future, ticker in pending.items()
+                    if ticker in clocks and elapsed(ticker, now) > timeout
+                ]
+            for future in expired:
+                ticker = pending.pop(future)
+                yield ticker, None, TimeoutError(f"Timed out after {timeout}s")
+    finally:
+        # Hung calls cannot be interrupted, but they must not hold up the caller
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -1,38 +1,104 @@
 # finance_data.py
 
-import yfinance as yf
+import time
+
 import numpy as np
 
-def get_stock_data(ticker_symbol):
-    stock = yf.Ticker(ticker_symbol)
-    # Fetch info
+from metrics_cache import get_metrics_cache, OFFLINE_MODE
+from metrics_table import MetricsRecord, to_float
+from providers import get_provider
+from request_scheduler import get_scheduler, SymbolNotFound
+from shared_store import get_single_flight
+from snapshot_store import record_snapshot
+from instrumentation import registry, span, inc, observe_ticker
+
+def get_stock_data(ticker_symbol, force_refresh=False, offline=OFFLINE_MODE, max_age=None):
+    # Returns the ticker's MetricsRecord and records latency and outcome
+    # (cache, upstream, stale or failed) per call.
+    # max_age is the oldest cached snapshot served without refetching; it
+    # defaults to the cache TTL.
+    start = time.perf_counter()
+    source = 'failed'
+    try:
+        # Concurrent requests for the same ticker, e.g. from several sessions,
+        # share one call
+        result, source = get_single_flight().do(
+            ('metrics', ticker_symbol, force_refresh, offline, max_age),
+            lambda: _get_stock_data(ticker_symbol, force_refresh, offline, max_age)
+        )
+        return result
+    finally:
+        seconds = time.perf_counter() - start
+        registry.observe('get_stock_data', seconds, source=source)
+        inc('ticker_fetches', source=source)
+        observe_ticker(ticker_symbol, seconds, source)
+
+def _get_stock_data(ticker_symbol, force_refresh, offline, max_age):
+    cache = get_metrics_cache()
+
+    # Serve a fresh snapshot from the local cache when there is one
+    if not force_refresh or offline:
+        cached = cache.get(ticker_symbol, max_age=float('inf') if offline else max_age)
+        if cached is not None:
+            return MetricsRecord.from_dict(cached[0]), 'cache'
+        if offline:
+            raise Exception(f"No cached data for {ticker_symbol} (offline mode)")
+
+    # Fetch info through the scheduler, falling back to the last known snapshot
+    # if upstream is unreachable or the symbol is being skipped
+    provider = get_provider()
+    stock = provider.ticker(ticker_symbol)
     try:
-        info = stock.info
+        with span('upstream_info'):
+            info = get_scheduler().call(ticker_symbol, lambda: fetch_info(stock), limited=provider.rate_limited)
     except Exception as e:
-        raise Exception(f"Error fetching data for {ticker_symbol}: {e}")
-
-    # Extract financial metrics with default values
-    current_price = info.get('currentPrice', np.nan)
-    pe_ratio = info.get('trailingPE', np.nan)
-    forward_pe = info.get('forwardPE', np.nan)
-    peg_ratio = info.get('pegRatio', np.nan)
-    pb_ratio = info.get('priceToBook', np.nan)
-    ps_ratio = info.get('priceToSalesTrailing12Months', np.nan)
-    dividend_yield = info.get('dividendYield', np.nan)
-    roe = info.get('returnOnEquity', np.nan)
-    eps = info.get('trailingEps', np.nan)
-    debt_to_equity = info.get('debtToEquity', np.nan)
-    profit_margin = info.get('profitMargins', np.nan)
-    beta = info.get('beta', np.nan)
-    enterprise_value = info.get('enterpriseValue', np.nan)
-    ebitda = info.get('ebitda', np.nan)
+        cached = cache.get(ticker_symbol, max_age=float('inf'))
+        if cached is not None:
+            return MetricsRecord.from_dict(cached[0]), 'stale'
+        raise Exception(f"Error fetching data for {ticker_symbol}: {e}") from e
+    inc('upstream_info_fields', len(info))
+
+    # Only the projected record is kept; the info payload and the ticker
+    # object holding it are dropped here
+    metrics = extract_metrics(info)
+    cache.put(ticker_symbol, metrics.to_dict())
+    record_snapshot(ticker_symbol, metrics)
+    return metrics, 'upstream'
+
+# Fields at least one of which is present in the info of any listed symbol
+IDENTITY_FIELDS = ('symbol', 'quoteType', 'shortName', 'currentPrice', 'regularMarketPrice')
+
+def fetch_info(stock):
+    # yfinance returns a near-empty payload rather than raising for unknown
+    # or delisted symbols; treat that as a permanent failure
+    info = stock.info
+    if not info or not any(info.get(field) is not None for field in IDENTITY_FIELDS):
+        raise SymbolNotFound(f"No data found for {stock.ticker}, symbol may be delisted")
+    return info
+
+def extract_metrics(info):
+    # Project the info payload onto the metrics schema; missing fields become NaN
+    current_price = to_float(info.get('currentPrice'))
+    pe_ratio = to_float(info.get('trailingPE'))
+    forward_pe = to_float(info.get('forwardPE'))
+    peg_ratio = to_float(info.get('pegRatio'))
+    pb_ratio = to_float(info.get('priceToBook'))
+    ps_ratio = to_float(info.get('priceToSalesTrailing12Months'))
+    dividend_yield = to_float(info.get('dividendYield'))
+    roe = to_float(info.get('returnOnEquity'))
+    eps = to_float(info.get('trailingEps'))
+    debt_to_equity = to_float(info.get('debtToEquity'))
+    profit_margin = to_float(info.get('profitMargins'))
+    beta = to_float(info.get('beta'))
+    enterprise_value = to_float(info.get('enterpriseValue'))
+    ebitda = to_float(info.get('ebitda'))
     sector = info.get('sector', 'N/A')
     industry = info.get('industry', 'N/A')
 
-    # Convert percentages
-    dividend_yield_percentage = dividend_yield * 100 if not np.isnan(dividend_yield) else np.nan
-    roe_percentage = roe * 100 if not np.isnan(roe) else np.nan
-    profit_margin_percentage = profit_margin * 100 if not np.isnan(profit_margin) else np.nan
+    # Convert percentages (NaN stays NaN)
+    dividend_yield_percentage = dividend_yield * 100
+    roe_percentage = roe * 100
+    profit_margin_percentage = profit_margin * 100
 
     # Calculate EV/EBITDA Ratio
     if not np.isnan(enterprise_value) and not np.isnan(ebitda) and ebitda != 0:
@@ -40,23 +106,23 @@ def get_stock_data(ticker_symbol):
     else:
         ev_ebitda_ratio = np.nan
 
-    # Store numerical values in the metrics dictionary
-    metrics = {
-        'Current Price ($)': current_price,
-        'PE Ratio': pe_ratio,
-        'PEG Ratio': peg_ratio,
-        'Price-to-Sales Ratio': ps_ratio,
-        'Forward PE': forward_pe,
-        'Price-to-Book Ratio': pb_ratio,
-        'EV/EBITDA Ratio': ev_ebitda_ratio,
-        'Dividend Yield (%)': dividend_yield_percentage,
-        'Return on Equity (%)': roe_percentage,
-        'Earnings Per Share ($)': eps,
-        'Debt-to-Equity Ratio': debt_to_equity,
-        'Profit Margin (%)': profit_margin_percentage,
-        'Beta': beta,
-        'Sector': sector,
-        'Industry': industry
-    }
-
-    return stock, metrics, sector, industry
+    # Values in NUMERIC_COLUMNS order
+    return MetricsRecord(
+        [
+            current_price,
+            pe_ratio,
+            peg_ratio,
+            ps_ratio,
+            forward_pe,
+            pb_ratio,
+            ev_ebitda_ratio,
+            dividend_yield_percentage,
+            roe_percentage,
+            eps,
+            debt_to_equity,
+            profit_margin_percentage,
+            beta,
+        ],
+        sector,
+        industry
+    )
@@ -0,0 +1,168 @@
+# indicators.py
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from price_history import get_price_history_store
+from instrumentation import span, inc
+
+# Indicator settings, overridable through environment variables
+BENCHMARK = os.environ.get('AI_FUND_BENCHMARK', 'SPY')  # ticker that rolling beta is measured against
+HISTORY_PERIOD = '2y'  # enough history for a 200-day average at the start of a one-year chart
+TRADING_DAYS = 252
+VOLATILITY_WINDOW = 63  # about three months of daily returns
+BETA_WINDOW = 126  # about six months of daily returns
+MOMENTUM_WINDOW = 126
+DRAWDOWN_WINDOW = TRADING_DAYS  # max drawdown is measured over the last year
+SMA_WINDOWS = (50, 200)
+CACHE_SIZE = 32  # indicator sets kept per process
+
+# Columns added to the comparison table, one value per ticker
+INDICATOR_COLUMNS = [
+    'Volatility (%)',
+    'Max Drawdown (%)',
+    'Momentum 6M (%)',
+    'vs 200D SMA (%)',
+    'Rolling Beta',
+]
+
+def rolling_sum(values, window):
+    # Trailing sums over axis 0 of a (dates x tickers) array, from one
+    # cumulative sum for every column at once. Windows with a missing value
+    # are NaN.
+    valid = ~np.isnan(values)
+    sums = np.cumsum(np.where(valid, values, 0.0), axis=0)
+    counts = np.cumsum(valid, axis=0)
+    sums = np.concatenate([np.zeros((1,) + values.shape[1:]), sums])
+    counts = np.concatenate([np.zeros((1,) + values.shape[1:], dtype=counts.dtype), counts])
+    result = np.full(values.shape, np.nan)
+    if len(values) >= window:
+        window_sums = sums[window:] - sums[:-window]
+        complete = counts[window:] - counts[:-window] == window
+        result[window - 1:] = np.where(complete, window_sums, np.nan)
+    return result
+
+def simple_moving_average(close, window):
+    return rolling_sum(close, window) / window
+
+def log_returns(close):
+    # Daily log returns with a NaN first row, so rows stay aligned with close
+    returns = np.full(close.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[1:] = np.diff(np.log(close), axis=0)
+    return returns
+
+def rolling_volatility(returns, window):
+    # Annualized standard deviation of returns over a trailing window
+    sums = rolling_sum(returns, window)
+    squares = rolling_sum(returns * returns, window)
+    variance = np.maximum(squares - sums * sums / window, 0.0) / (window - 1)
+    return np.sqrt(variance * TRADING_DAYS)
+
+def rolling_beta(returns, benchmark_returns, window):
+    # Covariance with the benchmark over its variance, over a trailing window,
+    # using only days where both have a return
+    benchmark = np.broadcast_to(benchmark_returns[:, None], returns.shape)
+    valid = ~np.isnan(returns) & ~np.isnan(benchmark)
+    returns = np.where(valid, returns, np.nan)
+    benchmark = np.where(valid, benchmark, np.nan)
+    sum_r, sum_b = rolling_sum(returns, window), rolling_sum(benchmark, window)
+    covariance = rolling_sum(returns * benchmark, window) - sum_r * sum_b / window
+    variance = rolling_sum(benchmark * benchmark, window) - sum_b * sum_b / window
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(variance > 0, covariance / variance, np.nan)
+
+def max_drawdown(close):
+    # Largest fall from a running peak, as a negative fraction per column
+    peaks = np.fmax.accumulate(close, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.fmin.reduce(close / peaks - 1, axis=0)
+
+def momentum(close, window):
+    # Return over the last `window` bars per column
+    if len(close) <= window:
+        return np.full(close.shape[1], np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return close[-1] / close[-1 - window] - 1
+
+class Indicators:
+    # Indicators for a set of tickers: `summary` has one row per ticker with
+    # INDICATOR_COLUMNS, the other frames are date x ticker series for charts
+
+    def __init__(self, summary, sma, volatility, beta):
+        self.summary = summary
+        self.sma = sma  # {window: frame}
+        self.volatility = volatility
+        self.beta = beta
+
+def compute_indicators(close, benchmark=None):
+    # Computes every indicator for all columns of a date x ticker close
+    # matrix in array operations, without a loop over tickers. `benchmark`
+    # is a close series on the same index; without one, beta is NaN.
+    values = close.to_numpy(dtype=np.float64, na_value=np.nan)
+    frame = lambda array: pd.DataFrame(array, index=close.index, columns=close.columns)
+    returns = log_returns(values)
+    sma = {window: simple_moving_average(values, window) for window in SMA_WINDOWS}
+    volatility = rolling_volatility(returns, VOLATILITY_WINDOW)
+    if benchmark is not None:
+        benchmark_returns = log_returns(benchmark.to_numpy(dtype=np.float64, na_value=np.nan)[:, None])[:, 0]
+    else:
+        benchmark_returns = np.full(len(values), np.nan)
+    beta = rolling_beta(returns, benchmark_returns, BETA_WINDOW)
+
+    last = lambda array: array[-1] if len(array) else np.full(values.shape[1], np.nan)
+    longest = max(SMA_WINDOWS)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        summary = pd.DataFrame({
+            'Volatility (%)': last(volatility) * 100,
+            'Max Drawdown (%)': max_drawdown(values[-DRAWDOWN_WINDOW:]) * 100 if len(values) else np.nan,
+            'Momentum 6M (%)': momentum(values, MOMENTUM_WINDOW) * 100,
+            'vs 200D SMA (%)': (last(values) / last(sma[longest]) - 1) * 100,
+            'Rolling Beta': last(beta),
+        }, index=close.columns)
+    return Indicators(summary, {window: frame(array) for window, array in sma.items()}, frame(volatility), frame(beta))
+
+class IndicatorEngine:
+    # Memoizes indicator sets per ticker list and benchmark on the price
+    # history store's version, so reruns reuse them until new bars are stored
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compute(self, tickers, benchmark=BENCHMARK):
+        tickers = list(dict.fromkeys(tickers))
+        store = get_price_history_store()
+        columns = list(dict.fromkeys(tickers + [benchmark]))
+        store.try_update_many(columns, period=HISTORY_PERIOD)
+        key = (tuple(tickers), benchmark, store.version)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                inc('indicator_cache', outcome='hit')
+                return self._cache[key]
+        inc('indicator_cache', outcome='miss')
+        with span('indicators', tickers=len(tickers)):
+            panel = store.panel(columns, period=HISTORY_PERIOD, update=False)
+            result = compute_indicators(panel[tickers], panel[benchmark] if panel[benchmark].notna().any() else None)
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+        return result
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_indicator_engine():
+    # Process-wide engine, created on first use
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = IndicatorEngine()
+        return _engine
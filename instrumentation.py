@@ -0,0 +1,149 @@
+# instrumentation.py
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# Emit one JSON log line per timed span when enabled
+JSON_LOGS = os.environ.get('AI_FUND_JSON_LOGS', '').lower() in ('1', 'true', 'yes')
+# File that the Prometheus text dump is written to after every app run, if set
+METRICS_FILE = os.environ.get('AI_FUND_METRICS_FILE')
+# Recent durations kept per timer for percentiles, and recent per-ticker latencies
+TIMING_WINDOW = 1000
+TICKER_WINDOW = 500
+
+logger = logging.getLogger('ai_fund.metrics')
+if JSON_LOGS and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+class Registry:
+    # Thread-safe in-process store of counters and timers
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._timers = {}
+            self._ticker_latency = OrderedDict()
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                timer = self._timers[key] = {'count': 0, 'sum': 0.0, 'recent': deque(maxlen=TIMING_WINDOW)}
+            timer['count'] += 1
+            timer['sum'] += seconds
+            timer['recent'].append(seconds)
+
+    def observe_ticker(self, ticker, seconds, outcome):
+        # Per-ticker latencies are kept apart from the timers so that large
+        # universes do not turn into one time series per symbol
+        with self._lock:
+            self._ticker_latency.pop(ticker, None)
+            self._ticker_latency[ticker] = (seconds, outcome, time.time())
+            while len(self._ticker_latency) > TICKER_WINDOW:
+                self._ticker_latency.popitem(last=False)
+
+    @contextmanager
+    def span(self, name, **labels):
+        # Times the block; the duration is recorded even if the block raises
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(name, seconds, **labels)
+            if JSON_LOGS:
+                event = {'event': 'span', 'name': name, 'seconds': round(seconds, 6), **labels}
+                if error is not None:
+                    event['error'] = type(error).__name__
+                logger.info(json.dumps(event, default=str))
+
+    def snapshot(self):
+        # Plain-data view of everything recorded, for the diagnostics panel
+        with self._lock:
+            timers = []
+            for (name, labels), timer in sorted(self._timers.items()):
+                recent = np.asarray(timer['recent']) * 1e3
+                timers.append({
+                    'span': name,
+                    'labels': ', '.join(f'{key}={value}' for key, value in labels),
+                    'count': timer['count'],
+                    'total (s)': timer['sum'],
+                    'p50 (ms)': float(np.percentile(recent, 50)),
+                    'p95 (ms)': float(np.percentile(recent, 95)),
+                    'max (ms)': float(recent.max()),
+                })
+            counters = [
+                {'counter': name, 'labels': ', '.join(f'{key}={value}' for key, value in labels), 'value': value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            tickers = [
+                {'ticker': ticker, 'latency (ms)': seconds * 1e3, 'outcome': outcome, 'at': at}
+                for ticker, (seconds, outcome, at) in reversed(self._ticker_latency.items())
+            ]
+        return {'timers': timers, 'counters': counters, 'tickers': tickers}
+
+    def to_prometheus(self, prefix='ai_fund'):
+        # Prometheus text exposition: counters as *_total, timers as summaries
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f'# TYPE {prefix}_{name}_total counter')
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f'{prefix}_{name}_total{_format_labels(labels)} {value}')
+            for name in sorted({name for name, _ in self._timers}):
+                lines.append(f'# TYPE {prefix}_{name}_seconds summary')
+                for (timer_name, labels), timer in sorted(self._timers.items()):
+                    if timer_name != name:
+                        continue
+                    recent = np.asarray(timer['recent'])
+                    for quantile in (0.5, 0.95, 0.99):
+                        value = float(np.quantile(recent, quantile))
+                        lines.append(f'{prefix}_{name}_seconds{_format_labels(labels, [("quantile", quantile)])} {value:.6f}')
+                    lines.append(f'{prefix}_{name}_seconds_sum{_format_labels(labels)} {timer["sum"]:.6f}')
+                    lines.append(f'{prefix}_{name}_seconds_count{_format_labels(labels)} {timer["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+registry = Registry()
+span = registry.span
+inc = registry.inc
+observe_ticker = registry.observe_ticker
@@ -0,0 +1,138 @@
+# metrics_cache.py
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Cache settings, overridable through environment variables
+CACHE_PATH = os.environ.get('AI_FUND_CACHE_PATH', os.path.join('.cache', 'metrics_cache.sqlite'))
+CACHE_TTL = float(os.environ.get('AI_FUND_CACHE_TTL', 15 * 60))  # seconds a snapshot counts as fresh
+CACHE_MAX_AGE = float(os.environ.get('AI_FUND_CACHE_MAX_AGE', 30 * 24 * 3600))  # snapshots older than this are evicted
+CACHE_MAX_ENTRIES = int(os.environ.get('AI_FUND_CACHE_MAX_ENTRIES', 50000))
+OFFLINE_MODE = os.environ.get('AI_FUND_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+# Run eviction once every this many writes
+EVICT_EVERY = 200
+# Tickers per query in get_many, below SQLite's bound parameter limit
+QUERY_CHUNK_SIZE = 500
+
+class MetricsCache:
+    # Persistent per-ticker store of metrics snapshots backed by SQLite.
+    # Each write replaces the ticker's snapshot and records when it was fetched.
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_age=CACHE_MAX_AGE, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._writes = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                " ticker TEXT PRIMARY KEY,"
+                " fetched_at REAL NOT NULL,"
+                " metrics TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS snapshots_fetched_at ON snapshots (fetched_at)")
+
+    @contextmanager
+    def _connect(self):
+        # A short-lived connection per call keeps the cache safe to use from worker threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, ticker, max_age=None):
+        # Returns (metrics, fetched_at) for the ticker, or None when there is no
+        # snapshot younger than max_age. max_age defaults to the cache TTL;
+        # pass float('inf') to accept a snapshot of any age.
+        if max_age is None:
+            max_age = self.ttl
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT metrics, fetched_at FROM snapshots WHERE ticker = ?", (ticker,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > max_age:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def get_many(self, tickers, max_age=float('inf')):
+        # Returns {ticker: (metrics, fetched_at)} for every ticker with a
+        # snapshot younger than max_age, in one query per chunk of tickers
+        tickers = list(dict.fromkeys(tickers))
+        cutoff = time.time() - max_age
+        snapshots = {}
+        with self._connect() as conn:
+            for i in range(0, len(tickers), QUERY_CHUNK_SIZE):
+                chunk = tickers[i:i + QUERY_CHUNK_SIZE]
+                rows = conn.execute(
+                    f"SELECT ticker, metrics, fetched_at FROM snapshots"
+                    f" WHERE ticker IN ({','.join('?' * len(chunk))}) AND fetched_at >= ?",
+                    (*chunk, cutoff)
+                ).fetchall()
+                for ticker, metrics, fetched_at in rows:
+                    snapshots[ticker] = (json.loads(metrics), fetched_at)
+        return snapshots
+
+    def changed_since(self, timestamp):
+        # Returns [(ticker, metrics, fetched_at)] for snapshots written after
+        # timestamp, oldest first, using the fetched_at index
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT ticker, metrics, fetched_at FROM snapshots WHERE fetched_at > ? ORDER BY fetched_at",
+                (timestamp,)
+            ).fetchall()
+        return [(ticker, json.loads(metrics), fetched_at) for ticker, metrics, fetched_at in rows]
+
+    def put(self, ticker, metrics):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshots (ticker, fetched_at, metrics) VALUES (?, ?, ?)",
+                (ticker, time.time(), json.dumps(metrics))
+            )
+        with self._lock:
+            self._writes += 1
+            due = self._writes % EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        # Drop snapshots past the maximum age, then the oldest beyond the size limit
+        with self._connect() as conn:
+            conn.execute("DELETE FROM snapshots WHERE fetched_at < ?", (time.time() - self.max_age,))
+            conn.execute(
+                "DELETE FROM snapshots WHERE ticker IN ("
+                " SELECT ticker FROM snapshots ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM snapshots")
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_metrics_cache():
+    # Process-wide cache instance, created on first use
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MetricsCache()
+        return _cache
+
+def set_metrics_cache(cache):
+    global _cache
+    with _cache_lock:
+        _cache = cache
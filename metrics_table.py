@@ -0,0 +1,158 @@
+# metrics_table.py
+
+import sys
+from array import array
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Columns of the metrics table, in display order
+NUMERIC_COLUMNS = [
+    'Current Price ($)',
+    'PE Ratio',
+    'PEG Ratio',
+    'Price-to-Sales Ratio',
+    'Forward PE',
+    'Price-to-Book Ratio',
+    'EV/EBITDA Ratio',
+    'Dividend Yield (%)',
+    'Return on Equity (%)',
+    'Earnings Per Share ($)',
+    'Debt-to-Equity Ratio',
+    'Profit Margin (%)',
+    'Beta'
+]
+CATEGORICAL_COLUMNS = ['Sector', 'Industry']
+COLUMNS = ['Ticker'] + NUMERIC_COLUMNS + CATEGORICAL_COLUMNS
+
+# Position of each numeric column in a record's values
+COLUMN_INDEX = {col: i for i, col in enumerate(NUMERIC_COLUMNS)}
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+class MetricsRecord:
+    # One ticker's metrics in the fixed table schema: the numeric columns
+    # packed into a float64 array in NUMERIC_COLUMNS order, plus the sector
+    # and industry labels, interned so records share one copy of each.
+    # Supports get() and [] by column name like the metrics dicts it replaces.
+
+    __slots__ = ('values', 'sector', 'industry')
+
+    def __init__(self, values, sector='N/A', industry='N/A'):
+        if not (isinstance(values, array) and values.typecode == 'd'):
+            values = array('d', map(to_float, values))
+        self.values = values
+        self.sector = sys.intern(str(sector))
+        self.industry = sys.intern(str(industry))
+
+    @classmethod
+    def from_dict(cls, metrics):
+        return cls(
+            [metrics.get(col) for col in NUMERIC_COLUMNS],
+            metrics.get('Sector', 'N/A'),
+            metrics.get('Industry', 'N/A')
+        )
+
+    def to_dict(self):
+        metrics = dict(zip(NUMERIC_COLUMNS, self.values))
+        metrics['Sector'] = self.sector
+        metrics['Industry'] = self.industry
+        return metrics
+
+    def get(self, column, default=None):
+        if column in COLUMN_INDEX:
+            return self.values[COLUMN_INDEX[column]]
+        if column == 'Sector':
+            return self.sector
+        if column == 'Industry':
+            return self.industry
+        return default
+
+    def __getitem__(self, column):
+        value = self.get(column, KeyError)
+        if value is KeyError:
+            raise KeyError(column)
+        return value
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, MetricsRecord)
+            and self.sector == other.sector and self.industry == other.industry
+            and np.array_equal(self.values, other.values, equal_nan=True)
+        )
+
+    def __repr__(self):
+        return f"MetricsRecord({self.to_dict()!r})"
+
+def as_record(metrics):
+    return metrics if isinstance(metrics, MetricsRecord) else MetricsRecord.from_dict(metrics)
+
+class MetricsTableBuilder:
+    # Accumulates metrics rows into one float64 matrix for the numeric metrics
+    # and one list per categorical metric. The matrix grows by doubling, so
+    # appending n rows costs O(n) and the DataFrame is materialized once.
+
+    def __init__(self, capacity=64):
+        self._size = 0
+        self._capacity = max(1, capacity)
+        self._tickers = []
+        self._values = np.full((self._capacity, len(NUMERIC_COLUMNS)), np.nan)
+        self._categorical = {col: [] for col in CATEGORICAL_COLUMNS}
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self, capacity):
+        grown = np.full((capacity, len(NUMERIC_COLUMNS)), np.nan)
+        grown[:self._size] = self._values[:self._size]
+        self._values = grown
+        self._capacity = capacity
+
+    def append(self, ticker, metrics):
+        # metrics is a MetricsRecord or a metrics dict
+        record = as_record(metrics)
+        if self._size == self._capacity:
+            self._grow(self._capacity * 2)
+        self._values[self._size] = record.values
+        self._tickers.append(ticker)
+        self._categorical['Sector'].append(record.sector)
+        self._categorical['Industry'].append(record.industry)
+        self._size += 1
+
+    def extend(self, tickers, records):
+        # Bulk path: copies every record's values into the matrix in one pass
+        records = [as_record(metrics) for metrics in records]
+        n = len(records)
+        if self._size + n > self._capacity:
+            self._grow(max(self._capacity * 2, self._size + n))
+        if n:
+            packed = np.frombuffer(b''.join([record.values.tobytes() for record in records]), dtype=np.float64)
+            self._values[self._size:self._size + n] = packed.reshape(n, len(NUMERIC_COLUMNS))
+        self._tickers.extend(tickers)
+        self._categorical['Sector'].extend(record.sector for record in records)
+        self._categorical['Industry'].extend(record.industry for record in records)
+        self._size += n
+
+    def to_frame(self):
+        data = {'Ticker': list(self._tickers)}
+        for j, col in enumerate(NUMERIC_COLUMNS):
+            data[col] = self._values[:self._size, j].copy()
+        for col, values in self._categorical.items():
+            data[col] = pd.Categorical(values)
+        return pd.DataFrame(data, columns=COLUMNS)
+
+def concat_metrics_frames(frames):
+    # pd.concat turns categoricals with different categories into object columns,
+    # so union the categories to keep the table's dtypes intact
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return MetricsTableBuilder().to_frame()
+    combined = pd.concat(frames, ignore_index=True)
+    for col in CATEGORICAL_COLUMNS:
+        combined[col] = union_categoricals([frame[col].astype('category') for frame in frames])
+    return combined
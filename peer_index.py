@@ -0,0 +1,181 @@
+# peer_index.py
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from metrics_cache import get_metrics_cache
+from metrics_table import as_record, COLUMN_INDEX
+from instrumentation import span, inc
+
+# Minimum number of peers with a value before a group is used for ranking;
+# smaller industries fall back to their sector, then to the whole universe
+MIN_PEERS = int(os.environ.get('AI_FUND_MIN_PEERS', 5))
+# Percentiles stored per group and metric; ranks are read off this grid
+QUANTILES = np.linspace(0, 100, 101)
+# Peer group levels from broadest to narrowest
+UNIVERSE = 'Universe'
+LEVELS = (UNIVERSE, 'Sector', 'Industry')
+
+def quantile_grid(values):
+    # Per-column value counts and QUANTILES percentiles of a (rows x columns)
+    # array, ignoring NaN, with linear interpolation like np.nanpercentile but
+    # from a single sort. The grid is (columns x quantiles) so each column's
+    # grid is contiguous for searching. Columns without values get NaN.
+    counts = np.count_nonzero(~np.isnan(values), axis=0)
+    ordered = np.sort(values, axis=0)  # NaN sorts last
+    positions = QUANTILES[:, None] / 100 * np.maximum(counts - 1, 0)
+    lower = np.floor(positions).astype(np.intp)
+    upper = np.minimum(lower + 1, np.maximum(counts - 1, 0))
+    columns = np.arange(values.shape[1])
+    below, above = ordered[lower, columns], ordered[upper, columns]
+    grid = below + (positions - lower) * (above - below)
+    grid[:, counts == 0] = np.nan
+    return counts, np.ascontiguousarray(grid.T)
+
+class PeerIndex:
+    # Per-sector, per-industry and universe-wide aggregates of every numeric
+    # metric: peer counts, medians and a 101-point quantile grid. Members are
+    # added or updated one ticker at a time; only the groups they touch are
+    # recomputed, and only when next read. A percentile rank is then a lookup
+    # in one group's grid instead of a groupby over the universe.
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._members = {}  # ticker -> (sector, industry, values)
+        self._groups = {}  # (level, name) -> set of tickers
+        self._stats = {}  # (level, name) -> (counts, grid)
+        self._dirty = set()
+        self._synced_at = 0.0
+        self.version = 0
+
+    def __len__(self):
+        return len(self._members)
+
+    def _group_keys(self, sector, industry):
+        return [(UNIVERSE, UNIVERSE), ('Sector', sector), ('Industry', industry)]
+
+    def update(self, ticker, metrics):
+        record = as_record(metrics)
+        with self._lock:
+            self._discard(ticker)
+            self._members[ticker] = (record.sector, record.industry, np.frombuffer(record.values, dtype=np.float64))
+            for key in self._group_keys(record.sector, record.industry):
+                self._groups.setdefault(key, set()).add(ticker)
+                self._dirty.add(key)
+            self.version += 1
+
+    def remove(self, ticker):
+        with self._lock:
+            if self._discard(ticker):
+                self.version += 1
+
+    def _discard(self, ticker):
+        member = self._members.pop(ticker, None)
+        if member is None:
+            return False
+        for key in self._group_keys(member[0], member[1]):
+            self._groups[key].discard(ticker)
+            self._dirty.add(key)
+        return True
+
+    def sync(self, cache=None):
+        # Applies snapshots written to the metrics cache since the last sync,
+        # including those written by other processes such as batch screening
+        cache = cache or get_metrics_cache()
+        with self._lock:
+            changes = cache.changed_since(self._synced_at)
+            for ticker, metrics, fetched_at in changes:
+                self.update(ticker, metrics)
+                self._synced_at = fetched_at
+        if changes:
+            inc('peer_index_updates', len(changes))
+
+    def _refresh(self):
+        # Recomputes the aggregates of groups whose membership changed
+        for key in self._dirty:
+            tickers = self._groups.get(key)
+            if not tickers:
+                self._groups.pop(key, None)
+                self._stats.pop(key, None)
+                continue
+            values = np.stack([self._members[ticker][2] for ticker in tickers])
+            self._stats[key] = quantile_grid(values)
+        self._dirty.clear()
+
+    def stats(self, level, name):
+        # Returns (counts, grid) for the group, with one column per numeric
+        # metric in NUMERIC_COLUMNS order, or None for an unknown group
+        with self._lock:
+            self._refresh()
+            return self._stats.get((level, name))
+
+    def median(self, level, name, column):
+        stats = self.stats(level, name)
+        if stats is None or stats[0][COLUMN_INDEX[column]] == 0:
+            return np.nan
+        return float(stats[1][COLUMN_INDEX[column], 50])
+
+    def peer_group(self, sector, industry, column, min_peers=MIN_PEERS):
+        # The narrowest group with enough peers for the metric, as (level, name)
+        j = COLUMN_INDEX[column]
+        with self._lock:
+            self._refresh()
+            for key in reversed(self._group_keys(sector, industry)):
+                stats = self._stats.get(key)
+                if stats is not None and stats[0][j] >= min_peers:
+                    return key
+        return None
+
+    def percentile_ranks(self, metrics_df, columns, min_peers=MIN_PEERS):
+        # Percentile rank (0-100) of every cell within its industry, falling
+        # back to its sector and then the universe when a group has fewer than
+        # min_peers values for the metric. Returns a (rows x columns) array;
+        # NaN where the value is missing or no group is large enough.
+        values = metrics_df[columns].to_numpy(dtype=float, na_value=np.nan)
+        metric_index = [COLUMN_INDEX[col] for col in columns]
+        ranks = np.full(values.shape, np.nan)
+        pending = ~np.isnan(values)
+        with self._lock, span('peer_ranks'):
+            self._refresh()
+            # Narrowest level first; cells ranked there are not looked up again
+            for level in reversed(LEVELS):
+                if not pending.any():
+                    break
+                if level == UNIVERSE:
+                    codes, names = np.zeros(len(metrics_df), dtype=np.intp), [UNIVERSE]
+                else:
+                    codes, names = pd.factorize(metrics_df[level].astype(str))
+                order = np.argsort(codes, kind='stable')
+                bounds = np.cumsum(np.bincount(codes, minlength=len(names)))
+                for code, name in enumerate(names):
+                    stats = self._stats.get((level, name))
+                    if stats is None:
+                        continue
+                    counts, grid = stats[0][metric_index], stats[1][metric_index]
+                    group_rows = order[bounds[code - 1] if code else 0:bounds[code]]
+                    for i in np.flatnonzero(counts >= min_peers):
+                        rows = group_rows[pending[group_rows, i]]
+                        if not len(rows):
+                            continue
+                        # Mid-rank by binary search in the group's grid
+                        cells = values[rows, i]
+                        below = np.searchsorted(grid[i], cells, side='left')
+                        at_or_below = np.searchsorted(grid[i], cells, side='right')
+                        ranks[rows, i] = np.clip((below + at_or_below) / 2 - 0.5, 0, 100)
+                        pending[rows, i] = False
+        return ranks
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_peer_index():
+    # Process-wide index, brought up to date with the metrics cache on every call
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = PeerIndex()
+    _index.sync()
+    return _index
@@ -0,0 +1,373 @@
+# price_history.py
+
+import os
+import json
+import time
+import threading
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from providers import get_provider
+from request_scheduler import get_scheduler
+from shared_store import get_single_flight
+from instrumentation import span, inc
+
+# Store settings, overridable through environment variables
+HISTORY_PATH = os.environ.get('AI_FUND_HISTORY_PATH', os.path.join('.cache', 'price_history'))
+HISTORY_CHECK_INTERVAL = float(os.environ.get('AI_FUND_HISTORY_CHECK_INTERVAL', 3600))  # seconds between upstream checks
+
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('AI_FUND_DOWNLOAD_CHUNK_SIZE', 50))  # tickers per batched request
+
+FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+def is_intraday(interval):
+    # Minute and hour bars, as opposed to '1d', '1wk', '1mo' and '3mo'
+    return interval[-1] in 'mh' and not interval.endswith('mo')
+
+def bar_length(interval):
+    # Span of one daily or longer bar ('1d', '1wk', '1mo', '3mo'), which is
+    # dated by its first day
+    if interval.endswith('mo'):
+        return pd.DateOffset(months=int(interval[:-2]))
+    if interval.endswith('wk'):
+        return pd.DateOffset(weeks=int(interval[:-2]))
+    return pd.DateOffset(days=int(interval[:-1]))
+
+def resume_date(last, interval):
+    # First date to request after the last stored bar: the start of the next
+    # bar. Intraday requests start on the same day, since the rest of its
+    # bars may still be missing.
+    return (last if is_intraday(interval) else last + bar_length(interval)).strftime('%Y-%m-%d')
+
+def period_start(period, now=None):
+    # Converts a yfinance period string ('5d', '6mo', '1y', 'ytd', 'max') into a start date
+    now = pd.Timestamp.now().normalize() if now is None else now
+    if period == 'max':
+        return pd.Timestamp('1900-01-01')
+    if period == 'ytd':
+        return pd.Timestamp(year=now.year, month=1, day=1)
+    if period.endswith('mo'):
+        return now - pd.DateOffset(months=int(period[:-2]))
+    if period.endswith('y'):
+        return now - pd.DateOffset(years=int(period[:-1]))
+    if period.endswith('wk'):
+        return now - pd.DateOffset(weeks=int(period[:-2]))
+    if period.endswith('d'):
+        return now - pd.DateOffset(days=int(period[:-1]))
+    raise ValueError(f"Unsupported period: {period}")
+
+def download_histories(tickers, interval='1d', chunk_size=None, **kwargs):
+    # Downloads OHLCV bars for many tickers with one grouped request per chunk
+    # and returns {ticker: frame}. kwargs are passed on (period or start).
+    chunk_size = chunk_size or DOWNLOAD_CHUNK_SIZE
+    tickers = list(dict.fromkeys(tickers))
+    histories = {}
+    provider = get_provider()
+    for i in range(0, len(tickers), chunk_size):
+        chunk = tickers[i:i + chunk_size]
+        with span('history_download', interval=interval):
+            # Batches are not keyed to a symbol, so they never trip the circuit breaker
+            data = get_scheduler().call(None, partial(
+                provider.download,
+                chunk,
+                interval=interval,
+                group_by='ticker',
+                auto_adjust=True,
+                threads=True,
+                progress=False,
+                **kwargs
+            ), limited=provider.rate_limited)
+        inc('history_download_requests')
+        if data.empty:
+            continue
+        inc('history_bytes', int(data.memory_usage(deep=True).sum()))
+        if not isinstance(data.columns, pd.MultiIndex):
+            data = pd.concat({chunk[0]: data}, axis=1)
+        for ticker in chunk:
+            if ticker in data.columns.get_level_values(0):
+                history = data[ticker].dropna(how='all')
+                if not history.empty:
+                    histories[ticker] = history
+    return histories
+
+def align_panel(columns, tickers=None):
+    # Aligns {ticker: series} onto one sorted date index as a float64 matrix.
+    # Gaps inside a ticker's trading range are forward-filled; dates before a
+    # ticker's first or after its last bar stay NaN rather than being extrapolated.
+    tickers = list(columns) if tickers is None else tickers
+    if not columns:
+        return pd.DataFrame(columns=tickers, dtype=np.float64)
+    panel = pd.concat(columns, axis=1).reindex(columns=tickers).astype(np.float64).sort_index()
+    panel = panel.dropna(how='all')
+    panel = panel.ffill().where(panel.bfill().notna())
+    panel.index.name = 'Date'
+    panel.columns.name = 'Ticker'
+    return panel
+
+class PriceHistoryStore:
+    # Local append-only OHLCV store with one directory per ticker and interval.
+    # Each field is a raw little-endian array file (Date as int64 nanoseconds,
+    # prices and volume as float64) that only ever grows, so reads are a
+    # memory-map of the requested range and updates append the new bars.
+    # The still-forming bar of the current session is kept in meta.json and
+    # replaced on every update, so the appended region never changes.
+
+    def __init__(self, root=HISTORY_PATH, check_interval=HISTORY_CHECK_INTERVAL):
+        self.root = root
+        self.check_interval = check_interval
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        # Bumped whenever bars are stored, so derived results can be cached on
+        # it; the version each ticker was last stored at is kept as well
+        self.version = 0
+        self._versions = {}
+
+    def _lock(self, key):
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _dir(self, ticker, interval):
+        return os.path.join(self.root, interval, ticker.upper())
+
+    def _read_meta(self, directory):
+        try:
+            with open(os.path.join(directory, 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, directory, meta):
+        tmp_path = os.path.join(directory, 'meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(directory, 'meta.json'))
+
+    def _length(self, directory):
+        # Rows fully written to every field; the Date file is written last
+        sizes = [os.path.getsize(os.path.join(directory, f'{name}.bin')) // 8 for name in ['Date'] + FIELDS
+                 if os.path.exists(os.path.join(directory, f'{name}.bin'))]
+        return min(sizes) if len(sizes) == len(FIELDS) + 1 else 0
+
+    def _map(self, directory, name, dtype, length):
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(directory, f'{name}.bin'), dtype=dtype, mode='r', shape=(length,))
+
+    def ticker_version(self, ticker, interval='1d'):
+        # Store version at which the ticker's bars last changed in this process
+        return self._versions.get((ticker, interval), 0)
+
+    def last_date(self, ticker, interval='1d'):
+        directory = self._dir(ticker, interval)
+        length = self._length(directory)
+        if length == 0:
+            return None
+        return pd.Timestamp(int(self._map(directory, 'Date', np.int64, length)[-1]))
+
+    def read(self, ticker, start=None, interval='1d'):
+        # Returns the stored bars from `start` onwards as a DataFrame indexed by Date
+        directory = self._dir(ticker, interval)
+        length = self._length(directory)
+        dates = self._map(directory, 'Date', np.int64, length)
+        first = 0 if start is None else int(np.searchsorted(dates, pd.Timestamp(start).value))
+        data = {name: np.array(self._map(directory, name, np.float64, length)[first:]) for name in FIELDS}
+        frame = pd.DataFrame(data, index=pd.DatetimeIndex(np.array(dates[first:]).astype('datetime64[ns]'), name='Date'))
+
+        live = self._read_meta(directory).get('live')
+        if live is not None and (frame.empty or pd.Timestamp(live['Date']) > frame.index[-1]):
+            live_bar = pd.DataFrame([{name: live[name] for name in FIELDS}],
+                                    index=pd.DatetimeIndex([pd.Timestamp(live['Date'])], name='Date'))
+            frame = pd.concat([frame, live_bar]) if not frame.empty else live_bar
+        return frame
+
+    def _write(self, directory, bars, mode):
+        # Appends (mode 'ab') or rewrites (mode 'wb') the field files; Date goes last
+        os.makedirs(directory, exist_ok=True)
+        if mode == 'ab':
+            # An interrupted append can leave some field files longer than
+            # Date; cut them back so the new rows line up
+            length = self._length(directory)
+            for name in ['Date'] + FIELDS:
+                path = os.path.join(directory, f'{name}.bin')
+                if os.path.getsize(path) > length * 8:
+                    os.truncate(path, length * 8)
+                    inc('history_truncations')
+        for name in FIELDS:
+            with open(os.path.join(directory, f'{name}.bin'), mode) as f:
+                f.write(bars[name].to_numpy(dtype=np.float64).tobytes())
+        with open(os.path.join(directory, 'Date.bin'), mode) as f:
+            f.write(bars.index.values.astype('datetime64[ns]').astype(np.int64).tobytes())
+
+    def _normalize(self, history):
+        # Drops the exchange timezone so bars are keyed by their local date/time
+        history = history[FIELDS].astype(np.float64)
+        index = history.index
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        history.index = pd.DatetimeIndex(index, name='Date')
+        return history[~history.index.duplicated(keep='last')].sort_index()
+
+    def _plan(self, ticker, period, interval, force):
+        # Works out what a ticker needs from upstream. Returns None when the
+        # stored bars are recent enough, otherwise (last stored date, backfill).
+        # A backfill refetches the whole period because it starts before the stored range.
+        directory = self._dir(ticker, interval)
+        meta = self._read_meta(directory)
+        covered_from = pd.Timestamp(meta['start']) if 'start' in meta else None
+        needs_backfill = covered_from is None or period_start(period) < covered_from
+        if not force and not needs_backfill and time.time() - meta.get('checked_at', 0) < self.check_interval:
+            return None
+        last = self.last_date(ticker, interval)
+        return last, needs_backfill or last is None
+
+    def _store(self, ticker, history, last, backfill, period, interval):
+        # Appends the downloaded bars after `last`, or rewrites the ticker on a backfill
+        directory = self._dir(ticker, interval)
+        if history.empty:
+            if last is not None:
+                # Upstream returns nothing on per-ticker glitches; keep the
+                # stored bars and range and only note that it was checked
+                meta = self._read_meta(directory)
+                meta['checked_at'] = time.time()
+                self._write_meta(directory, meta)
+                inc('history_empty_downloads', interval=interval)
+                return
+            # Tickers without any bars (delisted or mistyped) are stored empty
+            history = pd.DataFrame(columns=FIELDS, index=pd.DatetimeIndex([], name='Date'), dtype=np.float64)
+        else:
+            history = self._normalize(history)
+
+        # Only completed bars are appended. The latest intraday bar is still
+        # forming, as is a daily or longer bar whose span reaches today (a
+        # weekly bar is dated by the week's Monday).
+        today = pd.Timestamp.now().normalize()
+        live = None
+        if not history.empty:
+            if not backfill:
+                history = history[history.index > last]
+            if not history.empty:
+                latest = history.index[-1]
+                forming = latest >= today if is_intraday(interval) else latest + bar_length(interval) > today
+                if forming:
+                    bar = history.iloc[-1]
+                    live = {'Date': latest.isoformat(), **{name: float(bar[name]) for name in FIELDS}}
+                    history = history[history.index < (latest if is_intraday(interval) else min(latest, today))]
+        if backfill or not history.empty:
+            self._write(directory, history, 'wb' if backfill else 'ab')
+
+        os.makedirs(directory, exist_ok=True)
+        meta = self._read_meta(directory)
+        meta['checked_at'] = time.time()
+        meta['live'] = live
+        if backfill:
+            meta['start'] = period_start(period).strftime('%Y-%m-%d')
+        self._write_meta(directory, meta)
+        with self._locks_lock:
+            self.version += 1
+            self._versions[(ticker, interval)] = self.version
+
+    def update(self, ticker, period='1y', interval='1d', force=False):
+        # Downloads only the bars after the last stored one. Upstream is checked
+        # at most once per check_interval unless forced, or when the requested
+        # period starts before the stored range.
+        with self._lock(self._dir(ticker, interval)):
+            plan = self._plan(ticker, period, interval, force)
+            if plan is None:
+                return
+            last, backfill = plan
+            provider = get_provider()
+            stock = provider.ticker(ticker)
+            if backfill:
+                fetch = partial(stock.history, period=period, interval=interval)
+            else:
+                fetch = partial(stock.history, start=resume_date(last, interval), interval=interval)
+            with span('history_download', interval=interval):
+                history = get_scheduler().call(ticker, fetch, limited=provider.rate_limited)
+            inc('history_download_requests')
+            inc('history_bytes', int(history.memory_usage(deep=True).sum()))
+            self._store(ticker, history, last, backfill, period, interval)
+
+    def update_many(self, tickers, period='1y', interval='1d', force=False, chunk_size=None):
+        # Same as update() for many tickers, but pulls them with grouped
+        # multi-ticker downloads: one batch for tickers needing a full period
+        # and one starting after the oldest last date for the rest.
+        # Tickers that another session is already updating are waited on
+        # rather than downloaded twice.
+        keys = [(ticker, period, interval) for ticker in dict.fromkeys(tickers)]
+        get_single_flight().do_many(
+            keys,
+            lambda owned: self._update_batch([ticker for ticker, _, _ in owned], period, interval, force, chunk_size)
+        )
+
+    def try_update_many(self, tickers, period='1y', interval='1d'):
+        # update_many() for readers that serve whatever is stored when
+        # upstream is unreachable; failures are counted rather than raised
+        try:
+            self.update_many(tickers, period=period, interval=interval)
+        except Exception:
+            inc('history_update_failures', interval=interval)
+
+    def _update_batch(self, tickers, period, interval, force, chunk_size):
+        plans = {}
+        for ticker in tickers:
+            plan = self._plan(ticker, period, interval, force)
+            if plan is not None:
+                plans[ticker] = plan
+
+        backfills = [ticker for ticker, (last, backfill) in plans.items() if backfill]
+        appends = [ticker for ticker, (last, backfill) in plans.items() if not backfill]
+        batches = []
+        if backfills:
+            batches.append((backfills, {'period': period}))
+        if appends:
+            first_missing = min(plans[ticker][0] for ticker in appends)
+            batches.append((appends, {'start': resume_date(first_missing, interval)}))
+
+        for batch, kwargs in batches:
+            histories = download_histories(batch, interval=interval, chunk_size=chunk_size, **kwargs)
+            for ticker in batch:
+                with self._lock(self._dir(ticker, interval)):
+                    last, backfill = plans[ticker]
+                    # Skip tickers another caller updated while we were downloading
+                    if not backfill and self.last_date(ticker, interval) != last:
+                        continue
+                    # One ticker failing to store must not hold up the rest of the batch
+                    try:
+                        self._store(ticker, histories.get(ticker, pd.DataFrame()), last, backfill, period, interval)
+                    except Exception:
+                        inc('history_store_failures', interval=interval)
+        return {}
+
+    def panel(self, tickers, period='1y', interval='1d', field='Close', update=True):
+        # Returns one date x ticker float64 matrix of `field` for all tickers,
+        # updating stale tickers with batched downloads first unless update is False
+        tickers = list(dict.fromkeys(tickers))
+        if update:
+            self.try_update_many(tickers, period=period, interval=interval)
+        start = period_start(period)
+        with span('history_read', interval=interval):
+            columns = {ticker: self.read(ticker, start=start, interval=interval)[field] for ticker in tickers}
+            return align_panel(columns, tickers)
+
+    def history(self, ticker, period='1y', interval='1d'):
+        # Serves the requested period from disk, appending any new bars first.
+        # If upstream is unreachable the stored bars are served as they are.
+        try:
+            self.update(ticker, period=period, interval=interval)
+        except Exception:
+            if self.last_date(ticker, interval) is None:
+                raise
+        return self.read(ticker, start=period_start(period), interval=interval)
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_price_history_store():
+    # Process-wide store instance, created on first use
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PriceHistoryStore()
+        return _store
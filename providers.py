@@ -0,0 +1,326 @@
+# providers.py
+
+import os
+import json
+import time
+import zlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Data provider selection: 'yahoo' (default), 'record:<dir>', 'replay:<dir>' or 'synthetic[:<seed>]'
+PROVIDER = os.environ.get('AI_FUND_PROVIDER', 'yahoo')
+
+# pandas frequencies used for fixture bars of each yfinance interval
+INTERVAL_FREQUENCIES = {
+    '1m': 'min', '2m': '2min', '5m': '5min', '15m': '15min', '30m': '30min',
+    '60m': 'h', '1h': 'h', '1d': 'B', '5d': '5B', '1wk': 'W-FRI', '1mo': 'MS', '3mo': 'QS',
+}
+
+def _slice_history(history, period=None, start=None, end=None):
+    # Applies yfinance's period/start/end arguments to a full fixture history.
+    # Periods are measured back from the last bar so replays are deterministic.
+    from price_history import period_start
+
+    if history.empty:
+        return history
+    index = history.index.tz_localize(None) if history.index.tz is not None else history.index
+    mask = np.ones(len(history), dtype=bool)
+    if start is not None:
+        mask &= index >= pd.Timestamp(start)
+    elif period is not None:
+        mask &= index >= period_start(period, now=index[-1].normalize())
+    if end is not None:
+        mask &= index < pd.Timestamp(end)
+    return history[mask]
+
+class MissingFixture(LookupError):
+    pass
+
+class YahooProvider:
+    # Live data from Yahoo Finance through yfinance
+
+    # Calls go to a remote API and are subject to the request scheduler's rate limit
+    rate_limited = True
+
+    def ticker(self, symbol):
+        import yfinance as yf
+
+        return yf.Ticker(symbol)
+
+    def download(self, tickers, **kwargs):
+        import yfinance as yf
+
+        return yf.download(tickers, **kwargs)
+
+class FixtureTicker:
+    # Stand-in for yf.Ticker backed by a fixture provider
+
+    def __init__(self, provider, symbol):
+        self.provider = provider
+        self.ticker = symbol
+
+    @property
+    def info(self):
+        return self.provider.info(self.ticker)
+
+    def history(self, period='1mo', interval='1d', start=None, end=None, **kwargs):
+        return self.provider.history(self.ticker, period=period, interval=interval, start=start, end=end)
+
+class FixtureProvider:
+    # Base class for providers that serve stored or generated payloads with the
+    # same ticker()/download() interface as YahooProvider. An optional latency
+    # per call stands in for network round-trips in benchmarks.
+
+    rate_limited = False
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def ticker(self, symbol):
+        return FixtureTicker(self, symbol)
+
+    def info(self, symbol):
+        self._wait()
+        return self.load_info(symbol)
+
+    def history(self, symbol, period=None, interval='1d', start=None, end=None):
+        self._wait()
+        return _slice_history(self.load_history(symbol, interval), period=period, start=start, end=end)
+
+    def download(self, tickers, period=None, interval='1d', start=None, end=None, group_by='column', **kwargs):
+        if isinstance(tickers, str):
+            tickers = tickers.split()
+        self._wait()
+        frames = {}
+        for symbol in tickers:
+            try:
+                history = _slice_history(self.load_history(symbol, interval), period=period, start=start, end=end)
+            except MissingFixture:
+                continue
+            frames[symbol] = history[['Open', 'High', 'Low', 'Close', 'Volume']]
+        if not frames:
+            return pd.DataFrame()
+        data = pd.concat(frames, axis=1)
+        if group_by != 'ticker':
+            data = data.swaplevel(0, 1, axis=1).sort_index(axis=1)
+        return data
+
+    def load_info(self, symbol):
+        raise NotImplementedError
+
+    def load_history(self, symbol, interval):
+        raise NotImplementedError
+
+class ReplayProvider(FixtureProvider):
+    # Serves .info payloads and price histories saved under a fixtures directory:
+    #   <directory>/info/<TICKER>.json
+    #   <directory>/history/<interval>/<TICKER>.parquet
+
+    def __init__(self, directory, latency=0.0):
+        super().__init__(latency)
+        self.directory = directory
+
+    def load_info(self, symbol):
+        path = os.path.join(self.directory, 'info', f'{symbol}.json')
+        if not os.path.exists(path):
+            raise MissingFixture(f"No recorded info for {symbol}")
+        with open(path) as f:
+            return json.load(f)
+
+    def load_history(self, symbol, interval):
+        path = os.path.join(self.directory, 'history', interval, f'{symbol}.parquet')
+        if not os.path.exists(path):
+            raise MissingFixture(f"No recorded {interval} history for {symbol}")
+        return pd.read_parquet(path)
+
+def save_info(directory, symbol, info):
+    os.makedirs(os.path.join(directory, 'info'), exist_ok=True)
+    with open(os.path.join(directory, 'info', f'{symbol}.json'), 'w') as f:
+        json.dump(info, f, default=str)
+
+def save_history(directory, symbol, interval, history):
+    # Merges the frame into the saved history so successive recordings accumulate
+    path = os.path.join(directory, 'history', interval, f'{symbol}.parquet')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        history = pd.concat([pd.read_parquet(path), history])
+        history = history[~history.index.duplicated(keep='last')].sort_index()
+    history.to_parquet(path)
+
+class RecordingTicker:
+    def __init__(self, provider, symbol):
+        self.provider = provider
+        self.ticker = symbol
+        self._inner = provider.inner.ticker(symbol)
+
+    @property
+    def info(self):
+        info = self._inner.info
+        with self.provider.lock:
+            save_info(self.provider.directory, self.ticker, info)
+        return info
+
+    def history(self, interval='1d', **kwargs):
+        history = self._inner.history(interval=interval, **kwargs)
+        if not history.empty:
+            with self.provider.lock:
+                save_history(self.provider.directory, self.ticker, interval, history)
+        return history
+
+class RecordingProvider:
+    # Passes calls through to another provider and saves every payload as a
+    # fixture that ReplayProvider can serve later
+
+    def __init__(self, directory, inner=None):
+        self.directory = directory
+        self.inner = inner or YahooProvider()
+        self.lock = threading.Lock()
+
+    @property
+    def rate_limited(self):
+        return self.inner.rate_limited
+
+    def ticker(self, symbol):
+        return RecordingTicker(self, symbol)
+
+    def download(self, tickers, interval='1d', group_by='column', **kwargs):
+        data = self.inner.download(tickers, interval=interval, group_by='ticker', **kwargs)
+        if not data.empty:
+            if not isinstance(data.columns, pd.MultiIndex):
+                data = pd.concat({tickers[0] if not isinstance(tickers, str) else tickers: data}, axis=1)
+            with self.lock:
+                for symbol in data.columns.get_level_values(0).unique():
+                    history = data[symbol].dropna(how='all')
+                    if not history.empty:
+                        save_history(self.directory, symbol, interval, history)
+        if group_by != 'ticker' and isinstance(data.columns, pd.MultiIndex):
+            data = data.swaplevel(0, 1, axis=1).sort_index(axis=1)
+        return data
+
+SYNTHETIC_SECTORS = {
+    'Technology': ['Semiconductors', 'Software - Infrastructure', 'Software - Application'],
+    'Communication Services': ['Internet Content & Information', 'Telecom Services'],
+    'Consumer Cyclical': ['Auto Manufacturers', 'Internet Retail'],
+    'Industrials': ['Aerospace & Defense', 'Specialty Industrial Machinery'],
+    'Utilities': ['Utilities - Regulated Electric'],
+    'Energy': ['Oil & Gas Integrated'],
+}
+
+class SyntheticProvider(FixtureProvider):
+    # Deterministic, plausible data for any symbol, seeded by the symbol name,
+    # so universes of any size can be generated without recordings
+
+    def __init__(self, seed=0, latency=0.0, years=10):
+        super().__init__(latency)
+        self.seed = seed
+        self.years = years
+        self.end = pd.Timestamp.now().normalize()
+
+    def _rng(self, symbol, salt):
+        return np.random.default_rng([self.seed, zlib.crc32(symbol.encode()), salt])
+
+    def load_info(self, symbol):
+        rng = self._rng(symbol, 0)
+        sector = list(SYNTHETIC_SECTORS)[rng.integers(len(SYNTHETIC_SECTORS))]
+        industries = SYNTHETIC_SECTORS[sector]
+        info = {
+            'symbol': symbol,
+            'currentPrice': float(rng.lognormal(4, 1)),
+            'trailingPE': float(rng.lognormal(3, 0.5)),
+            'forwardPE': float(rng.lognormal(2.9, 0.5)),
+            'pegRatio': float(rng.lognormal(0.3, 0.6)),
+            'priceToBook': float(rng.lognormal(1.2, 0.8)),
+            'priceToSalesTrailing12Months': float(rng.lognormal(1.2, 0.9)),
+            'dividendYield': float(rng.uniform(0, 0.06)),
+            'returnOnEquity': float(rng.normal(0.15, 0.15)),
+            'trailingEps': float(rng.normal(3, 4)),
+            'debtToEquity': float(rng.lognormal(0, 0.8)),
+            'profitMargins': float(rng.normal(0.12, 0.12)),
+            'beta': float(rng.normal(1.1, 0.4)),
+            'enterpriseValue': float(rng.lognormal(23, 1.5)),
+            'ebitda': float(rng.lognormal(20.5, 1.5)),
+            'sector': sector,
+            'industry': industries[rng.integers(len(industries))],
+        }
+        # Like Yahoo, some payloads are missing fields
+        for key in ('pegRatio', 'dividendYield', 'forwardPE'):
+            if rng.random() < 0.1:
+                del info[key]
+        return info
+
+    def load_history(self, symbol, interval):
+        frequency = INTERVAL_FREQUENCIES.get(interval, 'B')
+        start = self.end - pd.DateOffset(years=self.years)
+        if (interval.endswith('m') and not interval.endswith('mo')) or interval.endswith('h'):
+            # Intraday bars only go back a few weeks, like Yahoo's limits
+            start = self.end - pd.DateOffset(days=30)
+        index = pd.date_range(start, self.end, freq=frequency, name='Date', inclusive='left')
+        rng = self._rng(symbol, 1)
+        close = rng.lognormal(4, 1) * np.exp(np.cumsum(rng.normal(0.0002, 0.02, len(index))))
+        spread = np.abs(rng.normal(0, 0.01, len(index)))
+        return pd.DataFrame({
+            'Open': close * (1 + rng.normal(0, 0.005, len(index))),
+            'High': close * (1 + spread),
+            'Low': close * (1 - spread),
+            'Close': close,
+            'Volume': rng.integers(1e5, 1e7, len(index)).astype(np.float64),
+        }, index=index)
+
+def synthetic_universe(n, prefix='SYN'):
+    return [f'{prefix}{i:05d}' for i in range(n)]
+
+def write_synthetic_fixtures(directory, n, seed=0, intervals=('1d',)):
+    # Writes a replayable fixture set for an n-ticker synthetic universe
+    provider = SyntheticProvider(seed=seed)
+    tickers = synthetic_universe(n)
+    for symbol in tickers:
+        save_info(directory, symbol, provider.load_info(symbol))
+        for interval in intervals:
+            save_history(directory, symbol, interval, provider.load_history(symbol, interval))
+    return tickers
+
+def provider_from_spec(spec):
+    kind, _, argument = spec.partition(':')
+    if kind == 'yahoo':
+        return YahooProvider()
+    if kind == 'replay':
+        return ReplayProvider(argument)
+    if kind == 'record':
+        return RecordingProvider(argument)
+    if kind == 'synthetic':
+        return SyntheticProvider(seed=int(argument or 0))
+    raise ValueError(f"Unknown data provider: {spec}")
+
+_provider = None
+_provider_lock = threading.Lock()
+
+def get_provider():
+    # Process-wide data provider, chosen by AI_FUND_PROVIDER on first use
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = provider_from_spec(PROVIDER)
+        return _provider
+
+def set_provider(provider):
+    global _provider
+    with _provider_lock:
+        _provider = provider
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a synthetic fixture universe for ReplayProvider.")
+    parser.add_argument('directory', help="fixtures directory to write")
+    parser.add_argument('-n', '--tickers', type=int, default=10000, help="number of synthetic tickers")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--intervals', nargs='+', default=['1d'], help="history intervals to generate")
+    args = parser.parse_args()
+    tickers = write_synthetic_fixtures(args.directory, args.tickers, seed=args.seed, intervals=args.intervals)
+    print(f"wrote fixtures for {len(tickers)} tickers to {args.directory}")
@@ -0,0 +1,118 @@
+# refresher.py
+
+import os
+import time
+import threading
+
+from metrics_cache import get_metrics_cache, CACHE_TTL, OFFLINE_MODE
+from finance_data import get_stock_data
+from price_history import get_price_history_store
+from watchlists import configured_tickers
+from indicators import HISTORY_PERIOD as INDICATOR_PERIOD, BENCHMARK
+from instrumentation import span, inc
+
+# Refresher settings, overridable through environment variables
+BACKGROUND_REFRESH = os.environ.get('AI_FUND_BACKGROUND_REFRESH', '1').lower() in ('1', 'true', 'yes')
+REFRESH_INTERVAL = float(os.environ.get('AI_FUND_REFRESH_INTERVAL', CACHE_TTL))  # seconds to cycle through every ticker
+WATCH_EXPIRY = 24 * 3600  # seconds a ticker added by a session stays watched after it was last shown
+HISTORY_PERIOD = INDICATOR_PERIOD  # price history kept warm for the chart and indicators
+RETRY_DELAY = 60  # seconds to wait after a cycle failed before starting the next
+
+class BackgroundRefresher:
+    # Daemon thread that keeps metrics snapshots and price histories warm for
+    # the configured tickers and every ticker a session is showing. Tickers
+    # are refreshed one at a time, spread evenly over the interval, so the
+    # whole universe is refreshed once per interval without bursts.
+
+    def __init__(self, interval=REFRESH_INTERVAL, tickers=None):
+        self.interval = interval
+        self._pinned = configured_tickers() if tickers is None else list(tickers)
+        self._watched = {}  # ticker -> last time a session showed it
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, tickers):
+        # Called on every script run with the tickers the session shows
+        now = time.time()
+        with self._lock:
+            for ticker in tickers:
+                self._watched[ticker] = now
+
+    def tickers(self):
+        now = time.time()
+        with self._lock:
+            for ticker, seen in list(self._watched.items()):
+                if now - seen > WATCH_EXPIRY:
+                    del self._watched[ticker]
+            return list(dict.fromkeys(self._pinned + list(self._watched)))
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.running:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='ai-fund-refresher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            # A failed cycle (e.g. the metrics cache being locked) must not end the thread
+            try:
+                self.run_cycle()
+            except Exception:
+                inc('background_refreshes', kind='cycle', outcome='failed')
+                self._stop.wait(RETRY_DELAY)
+
+    def run_cycle(self):
+        tickers = self.tickers()
+        if not tickers:
+            self._stop.wait(self.interval)
+            return
+        # Price histories go out in a few batched requests at the start of the
+        # cycle, including the benchmark that indicators are measured against
+        try:
+            get_price_history_store().update_many(tickers + [BENCHMARK], period=HISTORY_PERIOD)
+        except Exception:
+            inc('background_refreshes', kind='history', outcome='failed')
+        # Oldest snapshots first; tickers refreshed recently, e.g. by a foreground
+        # fetch, are skipped but keep their slot so the pacing stays even
+        cache = get_metrics_cache()
+        snapshots = cache.get_many(tickers)
+        tickers.sort(key=lambda ticker: snapshots[ticker][1] if ticker in snapshots else 0.0)
+        slot = self.interval / len(tickers)
+        for ticker in tickers:
+            if self._stop.wait(slot):
+                return
+            if cache.get(ticker, max_age=self.interval / 2) is not None:
+                continue
+            try:
+                with span('background_refresh'):
+                    get_stock_data(ticker, force_refresh=True)
+                inc('background_refreshes', kind='metrics', outcome='ok')
+            except Exception:
+                inc('background_refreshes', kind='metrics', outcome='failed')
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+def get_refresher():
+    # Process-wide refresher, started on first use and restarted if its thread
+    # has died. Returns None when background refresh is disabled or the app
+    # runs offline.
+    global _refresher
+    if not BACKGROUND_REFRESH or OFFLINE_MODE:
+        return None
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = BackgroundRefresher()
+        if not _refresher.running:
+            if _refresher._thread is not None:
+                inc('background_refresher_restarts')
+            _refresher.start()
+        return _refresher
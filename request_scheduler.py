@@ -0,0 +1,201 @@
+# request_scheduler.py
+
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+from instrumentation import inc
+
+# Scheduler settings, overridable through environment variables
+RATE_LIMIT = float(os.environ.get('AI_FUND_RATE_LIMIT', 5))  # sustained upstream requests per second, 0 for no limit
+RATE_BURST = int(os.environ.get('AI_FUND_RATE_BURST', 10))  # requests allowed back to back
+MAX_RETRIES = int(os.environ.get('AI_FUND_MAX_RETRIES', 3))  # retries for transient errors
+BACKOFF_BASE = 0.5  # seconds before the first retry, doubled on each attempt
+BACKOFF_MAX = 8.0
+THROTTLE_PAUSE = 1.0  # seconds all requests wait after upstream reports throttling
+MIN_RATE = 0.5  # floor for the adaptive rate, in requests per second
+RATE_RECOVERY = 0.5  # requests per second regained per second of successful requests
+BREAKER_THRESHOLD = 2  # permanent failures before a symbol is skipped
+BREAKER_COOLDOWN = float(os.environ.get('AI_FUND_BREAKER_COOLDOWN', 3600))  # seconds a symbol is skipped
+
+# Error text that marks an upstream failure as worth retrying, or as permanent
+THROTTLE_MARKERS = ('429', 'too many requests', 'rate limit')
+TRANSIENT_MARKERS = THROTTLE_MARKERS + (
+    'timed out', 'timeout', 'temporarily', 'connection', '500', '502', '503', '504', 'reset by peer'
+)
+PERMANENT_MARKERS = ('404', 'not found', 'delisted', 'no data found', 'invalid', 'no recorded')
+
+class CircuitOpen(Exception):
+    pass
+
+class SymbolNotFound(Exception):
+    pass
+
+def _message(error):
+    return f"{type(error).__name__}: {error}".lower()
+
+def is_throttled(error):
+    return any(marker in _message(error) for marker in THROTTLE_MARKERS)
+
+def is_transient(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    message = _message(error)
+    if any(marker in message for marker in PERMANENT_MARKERS):
+        return False
+    return any(marker in message for marker in TRANSIENT_MARKERS)
+
+class TokenBucket:
+    # Allows `rate` requests per second on average with bursts up to `capacity`.
+    # Callers reserve the next free slot and sleep until it, so waiting threads
+    # are served in arrival order instead of racing for tokens.
+    # The rate adapts to upstream: it is halved when upstream throttles us
+    # (at most once per second, since in-flight requests report the same
+    # throttling) and creeps back up towards the configured rate on success.
+
+    def __init__(self, rate=RATE_LIMIT, capacity=RATE_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._next = 0.0  # earliest time of the next slot when no burst is left
+        self._throttled_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # Blocks until the caller's slot; a rate of 0 disables the limit
+        if self.max_rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now - (self.capacity - 1) / self.rate)
+            self._next = slot + 1 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def throttled(self):
+        # Multiplicative decrease, and a short pause for requests not yet scheduled
+        with self._lock:
+            now = time.monotonic()
+            if now - self._throttled_at < 1.0:
+                return
+            self._throttled_at = now
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self._next = max(self._next, now + THROTTLE_PAUSE)
+
+    def succeeded(self):
+        # Additive increase back towards the configured rate
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + RATE_RECOVERY / self.rate)
+
+class CircuitBreaker:
+    # Stops calling upstream for a key after repeated permanent failures,
+    # until the cool-down has passed
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = {}
+        self._open_until = {}
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        with self._lock:
+            until = self._open_until.get(key)
+            if until is None:
+                return
+            if time.monotonic() < until:
+                raise CircuitOpen(f"Skipping {key} for {until - time.monotonic():.0f}s after repeated failures")
+            # Cool-down over: allow one more attempt
+            del self._open_until[key]
+            self._failures[key] = self.threshold - 1
+
+    def record_success(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+    def record_failure(self, key):
+        with self._lock:
+            self._failures[key] = self._failures.get(key, 0) + 1
+            if self._failures[key] >= self.threshold:
+                self._open_until[key] = time.monotonic() + self.cooldown
+                inc('circuit_opened')
+
+_listeners = threading.local()
+
+def set_wait_listener(listener):
+    # Registers listener(waiting) for upstream calls made on the current
+    # thread: it is called with True before the scheduler waits for a rate
+    # limit slot or a retry backoff and with False once the wait is over, so
+    # callers can leave that time out of their deadlines. None removes it.
+    _listeners.listener = listener
+
+@contextmanager
+def _waiting():
+    listener = getattr(_listeners, 'listener', None)
+    if listener is not None:
+        listener(True)
+    try:
+        yield
+    finally:
+        if listener is not None:
+            listener(False)
+
+class RequestScheduler:
+    # Sits in front of upstream calls: rate limits them, retries transient
+    # errors with exponential backoff and full jitter, and trips a per-symbol
+    # circuit breaker on permanent ones
+
+    def __init__(self, bucket=None, breaker=None, max_retries=MAX_RETRIES):
+        self.bucket = bucket or TokenBucket()
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max_retries
+
+    def call(self, key, fn, limited=True):
+        # Calls fn() with no arguments. key identifies the symbol for the
+        # circuit breaker; pass None for batched calls that should not trip it.
+        # limited=False skips the rate limit, for providers that are not remote.
+        if key is not None:
+            self.breaker.check(key)
+        for attempt in range(self.max_retries + 1):
+            if limited:
+                with _waiting():
+                    self.bucket.acquire()
+            try:
+                result = fn()
+            except Exception as e:
+                if is_throttled(e):
+                    inc('upstream_throttled')
+                    if limited:
+                        self.bucket.throttled()
+                if is_transient(e) and attempt < self.max_retries:
+                    inc('upstream_retries')
+                    with _waiting():
+                        time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+                    continue
+                if key is not None and not is_transient(e):
+                    self.breaker.record_failure(key)
+                raise
+            if limited:
+                self.bucket.succeeded()
+            if key is not None:
+                self.breaker.record_success(key)
+            return result
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    # Process-wide scheduler, created on first use
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
+
+def set_scheduler(scheduler):
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
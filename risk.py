@@ -0,0 +1,212 @@
+# risk.py
+
+import numpy as np
+import pandas as pd
+
+from price_history import get_price_history_store
+from indicators import TRADING_DAYS
+from instrumentation import span, inc
+
+RISK_PERIOD = '1y'  # daily returns the covariance is estimated from
+# Rebuild from scratch instead of updating when more tickers than this
+# fraction of the model change at once
+REBUILD_FRACTION = 0.5
+
+def returns_matrix(close):
+    # Daily log returns of a date x ticker close matrix, demeaned per column.
+    # Missing returns (before a listing, or gaps) become zero after
+    # demeaning, i.e. they add nothing to the covariance.
+    values = close.to_numpy(dtype=np.float64, na_value=np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.diff(np.log(values), axis=0)
+    valid = np.isfinite(returns)
+    counts = np.maximum(valid.sum(axis=0), 1)
+    means = np.where(valid, returns, 0.0).sum(axis=0) / counts
+    return np.where(valid, returns - means, 0.0)
+
+class RiskModel:
+    # Covariance of daily returns for a set of tickers over fixed dates, kept
+    # as the cross-product matrix of the demeaned returns in buffers with
+    # spare capacity. Adding a ticker costs one matrix-vector product against
+    # the existing returns; removing one moves the last ticker into its slot.
+    # Neither recomputes the other pairs, so a 500-name model changes in
+    # milliseconds. The estimate is shrunk towards a scaled identity
+    # (Ledoit-Wolf) so it stays well-conditioned even with more tickers than
+    # days; the sums the shrinkage needs are updated alongside.
+
+    def __init__(self, close_dates, period=RISK_PERIOD, capacity=16):
+        self.close_dates = close_dates
+        self.dates = close_dates[1:]  # return dates, one per row
+        self.period = period
+        self.versions = {}  # ticker -> price history version its returns were read at
+        self.tickers = []  # in slot order, which changes as tickers are removed
+        self._returns = np.zeros((len(self.dates), capacity))
+        self._cross = np.zeros((capacity, capacity))  # cross products of the returns, unscaled
+        self._cross_norm = 0.0  # sum of squared cross products
+        self._row_squares = np.zeros(len(self.dates))  # sum of squared returns per day
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def _reserve(self, size):
+        capacity = self._cross.shape[0]
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity)
+        n = len(self.tickers)
+        returns = np.zeros((len(self.dates), capacity))
+        returns[:, :n] = self._returns[:, :n]
+        cross = np.zeros((capacity, capacity))
+        cross[:n, :n] = self._cross[:n, :n]
+        self._returns, self._cross = returns, cross
+
+    def add(self, ticker, returns):
+        # Adds one ticker's demeaned returns on the model's dates
+        if ticker in self.tickers:
+            self.remove(ticker)
+        returns = np.asarray(returns, dtype=np.float64)
+        n = len(self.tickers)
+        self._reserve(n + 1)
+        cross = self._returns[:, :n].T @ returns
+        own = returns @ returns
+        self._returns[:, n] = returns
+        self._cross[:n, n] = self._cross[n, :n] = cross
+        self._cross[n, n] = own
+        self._cross_norm += 2 * (cross @ cross) + own * own
+        self._row_squares += returns * returns
+        self.tickers.append(ticker)
+        inc('risk_model_updates', change='add')
+
+    def add_many(self, tickers, returns):
+        # Adds several tickers at once; returns is (dates x tickers). An empty
+        # model is filled with one matrix product.
+        if self.tickers:
+            for j, ticker in enumerate(tickers):
+                self.add(ticker, returns[:, j])
+            return
+        n = len(tickers)
+        self._reserve(n)
+        self._returns[:, :n] = returns
+        self._cross[:n, :n] = self._returns[:, :n].T @ self._returns[:, :n]
+        self._cross_norm = float(np.sum(self._cross[:n, :n] ** 2))
+        self._row_squares = (self._returns[:, :n] ** 2).sum(axis=1)
+        self.tickers = list(tickers)
+        inc('risk_model_updates', change='build')
+
+    def remove(self, ticker):
+        j = self.tickers.index(ticker)
+        last = len(self.tickers) - 1
+        column, row = self._returns[:, j], self._cross[j, :last + 1]
+        self._row_squares -= column * column
+        self._cross_norm -= 2 * (row @ row) - row[j] * row[j]
+        # The last ticker takes over the slot
+        if j != last:
+            self._returns[:, j] = self._returns[:, last]
+            self._cross[j, :last + 1] = self._cross[last, :last + 1]
+            self._cross[:last + 1, j] = self._cross[:last + 1, last]
+            self._cross[j, j] = self._cross[last, last]
+            self.tickers[j] = self.tickers[last]
+        self._cross[last, :last + 1] = self._cross[:last + 1, last] = 0.0
+        self._returns[:, last] = 0.0
+        self.tickers.pop()
+        inc('risk_model_updates', change='remove')
+
+    def shrinkage(self):
+        # Ledoit-Wolf shrinkage intensity towards mu * I and mu, from the
+        # sample covariance's trace and norm and the per-day squared return norms
+        days, n = len(self.dates), len(self.tickers)
+        if days == 0 or n == 0:
+            return 0.0, 0.0
+        mu = np.trace(self._cross[:n, :n]) / days / n
+        sample_norm = self._cross_norm / days ** 2
+        delta = (sample_norm - n * mu * mu) / n
+        beta = (np.sum(self._row_squares ** 2) / days - sample_norm) / (n * days)
+        intensity = 0.0 if delta <= 0 else min(max(beta, 0.0), delta) / delta
+        return intensity, mu
+
+    def _order(self, tickers):
+        # Slots of tickers, all of the model's in slot order by default
+        if tickers is None:
+            return np.arange(len(self.tickers))
+        slots = {ticker: i for i, ticker in enumerate(self.tickers)}
+        return np.array([slots[ticker] for ticker in tickers], dtype=np.intp)
+
+    def covariance_matrix(self, tickers=None):
+        # Annualized, shrunk covariance as an array, in the given ticker order
+        order = self._order(tickers)
+        intensity, mu = self.shrinkage()
+        covariance = (1 - intensity) * self._cross[np.ix_(order, order)] / max(len(self.dates), 1)
+        covariance[np.diag_indices_from(covariance)] += intensity * mu
+        return covariance * TRADING_DAYS
+
+    def covariance(self, tickers=None):
+        tickers = list(self.tickers) if tickers is None else list(tickers)
+        return pd.DataFrame(self.covariance_matrix(tickers), index=tickers, columns=tickers)
+
+    def correlation(self, tickers=None):
+        tickers = list(self.tickers) if tickers is None else list(tickers)
+        covariance = self.covariance_matrix(tickers)
+        scale = np.sqrt(np.diag(covariance))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation = covariance / np.outer(scale, scale)
+        return pd.DataFrame(correlation, index=tickers, columns=tickers)
+
+    def portfolio(self, weights, tickers=None):
+        # Annualized volatility of a portfolio and each ticker's contribution
+        # to it, with rows in the given order. weights maps tickers to
+        # weights and is normalized to sum to one; tickers without a weight
+        # get zero. Contributions sum to the portfolio volatility. Works on
+        # the stored cross products without building the covariance matrix.
+        tickers = list(self.tickers) if tickers is None else list(tickers)
+        order = self._order(tickers)
+        n, days = len(self.tickers), max(len(self.dates), 1)
+        w = np.zeros(n)
+        w[order] = [weights.get(ticker, 0.0) for ticker in tickers]
+        if w.sum() != 0:
+            w = w / w.sum()
+        intensity, mu = self.shrinkage()
+        cross = self._cross[:n, :n]
+        marginal = ((1 - intensity) * (cross @ w) / days + intensity * mu * w) * TRADING_DAYS
+        variances = ((1 - intensity) * np.diag(cross) / days + intensity * mu) * TRADING_DAYS
+        volatility = float(np.sqrt(max(w @ marginal, 0.0)))
+        contribution = w * marginal / volatility if volatility > 0 else np.zeros_like(w)
+        return volatility, pd.DataFrame({
+            'Weight': w[order],
+            'Volatility': np.sqrt(variances[order]),
+            'Risk Contribution': contribution[order],
+            'Risk Contribution (%)': (contribution / volatility * 100 if volatility > 0 else contribution)[order],
+        }, index=pd.Index(tickers, name='Ticker'))
+
+def update_risk_model(model, tickers, period=RISK_PERIOD):
+    # Brings a model in line with tickers: builds one when there is none or
+    # the stored prices changed, otherwise adds and removes the difference
+    tickers = list(dict.fromkeys(tickers))
+    store = get_price_history_store()
+    store.try_update_many(tickers, period=period)
+    # The model is kept while the bars of the tickers it holds are unchanged
+    current = model is not None and model.period == period and len(model.dates) and all(
+        store.ticker_version(ticker) == version for ticker, version in model.versions.items()
+    )
+    if current:
+        added = [ticker for ticker in tickers if ticker not in model.tickers]
+        removed = [ticker for ticker in model.tickers if ticker not in tickers]
+        if len(added) + len(removed) <= REBUILD_FRACTION * max(len(model), 1):
+            with span('risk_model_update'):
+                for ticker in removed:
+                    model.remove(ticker)
+                    del model.versions[ticker]
+                if added:
+                    # New closes on the model's dates, filled inside each ticker's trading range
+                    close = store.panel(added, period=period, update=False).reindex(model.close_dates)
+                    close = close.ffill().where(close.bfill().notna())
+                    returns = returns_matrix(close)
+                    for j, ticker in enumerate(added):
+                        model.add(ticker, returns[:, j])
+                        model.versions[ticker] = store.ticker_version(ticker)
+            return model
+    with span('risk_model_build', tickers=len(tickers)):
+        close = store.panel(tickers, period=period, update=False)
+        model = RiskModel(close.index, period=period)
+        model.add_many(tickers, returns_matrix(close))
+        model.versions = {ticker: store.ticker_version(ticker) for ticker in tickers}
+    return model
@@ -0,0 +1,103 @@
+# screen_universe.py
+
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from finance_data import get_stock_data
+from watchlists import read_tickers
+from request_scheduler import RATE_LIMIT, RequestScheduler, TokenBucket, set_scheduler
+from metrics_table import MetricsRecord, MetricsTableBuilder
+from evaluations import score_metrics_frame
+
+def read_checkpoint(path):
+    # Returns {ticker: record} for every ticker already processed
+    done = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A partially written last line from an interrupted run
+                    continue
+                done[record['ticker']] = record
+    return done
+
+def init_worker(rate):
+    # Each worker process has its own scheduler, so the upstream rate limit is
+    # split between them
+    set_scheduler(RequestScheduler(TokenBucket(rate=rate)))
+
+def fetch_ticker(ticker, force_refresh=False):
+    # Runs in a worker process; errors are returned rather than raised so the
+    # batch keeps going
+    try:
+        metrics = get_stock_data(ticker, force_refresh=force_refresh)
+        return {'ticker': ticker, 'metrics': metrics.to_dict()}
+    except Exception as e:
+        return {'ticker': ticker, 'error': str(e)}
+
+def screen(tickers, output, checkpoint=None, workers=None, force_refresh=False, retry_failed=False):
+    checkpoint = checkpoint or output + '.checkpoint.jsonl'
+    done = read_checkpoint(checkpoint)
+    if retry_failed:
+        done = {ticker: record for ticker, record in done.items() if 'metrics' in record}
+    todo = [ticker for ticker in tickers if ticker not in done]
+    print(f"{len(tickers)} tickers, {len(tickers) - len(todo)} already in checkpoint, {len(todo)} to fetch", file=sys.stderr)
+
+    if todo:
+        workers = workers or os.cpu_count() or 1
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(RATE_LIMIT / workers,))
+        with open(checkpoint, 'a') as log, executor:
+            futures = [executor.submit(fetch_ticker, ticker, force_refresh) for ticker in todo]
+            for completed, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                done[record['ticker']] = record
+                # Each result is flushed as soon as it arrives so an interrupted run can resume
+                log.write(json.dumps(record) + '\n')
+                log.flush()
+                if completed % 100 == 0 or completed == len(todo):
+                    print(f"fetched {completed}/{len(todo)}", file=sys.stderr)
+
+    fetched, records, failed = [], [], []
+    for ticker in tickers:
+        record = done.get(ticker)
+        if record is not None and 'metrics' in record:
+            fetched.append(ticker)
+            records.append(MetricsRecord.from_dict(record['metrics']))
+        elif record is not None:
+            failed.append(ticker)
+    builder = MetricsTableBuilder(capacity=len(records))
+    builder.extend(fetched, records)
+    metrics_df = builder.to_frame()
+    result = pd.concat([metrics_df, score_metrics_frame(metrics_df)], axis=1)
+    result.to_parquet(output, index=False)
+    print(f"wrote {len(result)} rows to {output}; {len(failed)} tickers failed", file=sys.stderr)
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch and score a ticker universe without the Streamlit UI.")
+    parser.add_argument('tickers', help="file with ticker symbols, separated by newlines, commas or spaces")
+    parser.add_argument('-o', '--output', default='screen_results.parquet', help="Parquet file to write")
+    parser.add_argument('--checkpoint', help="JSONL checkpoint used to resume (default: <output>.checkpoint.jsonl)")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--force-refresh', action='store_true', help="ignore fresh snapshots in the metrics cache")
+    parser.add_argument('--retry-failed', action='store_true', help="refetch tickers that failed in a previous run")
+    args = parser.parse_args(argv)
+
+    screen(
+        read_tickers(args.tickers),
+        args.output,
+        checkpoint=args.checkpoint,
+        workers=args.workers,
+        force_refresh=args.force_refresh,
+        retry_failed=args.retry_failed
+    )
+
+if __name__ == "__main__":
+    main()
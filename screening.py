@@ -0,0 +1,207 @@
+# screening.py
+
+import ast
+import operator
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from evaluations import METRIC_THRESHOLDS, score_metrics_frame
+from instrumentation import span, inc
+
+# Compiled screens kept per process, keyed by expression text
+MEMO_SIZE = 256
+TOTAL_SCORE = 'Total Score'
+
+class ScreenError(ValueError):
+    pass
+
+COMPARISONS = {
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+}
+ARITHMETIC = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+}
+
+class Screen:
+    # A screening expression compiled once into a tree of closures that each
+    # evaluate a whole column at a time. Column names are written in quotes
+    # ("PE Ratio") or bare when they are identifiers (Beta); a quoted string
+    # that is not a column of the table is a string constant, e.g. for
+    # Sector == "Technology". Comparisons with missing values are False.
+    #
+    #   "PE Ratio" < 20 and "Return on Equity (%)" > 15
+    #   0.5 <= Beta <= 1.5 or not (Sector == "Utilities")
+
+    def __init__(self, expression):
+        self.expression = expression
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as e:
+            raise ScreenError(f"Invalid expression: {e.msg}") from e
+        self._evaluate = self._compile(tree.body)
+
+    def _compile(self, node):
+        if isinstance(node, ast.BoolOp):
+            parts = [self._compile(value) for value in node.values]
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            # Constant operands (True, 1 < 2) are spread over every row
+            return lambda frame: combine.reduce([
+                np.broadcast_to(np.asarray(part(frame), dtype=bool), (len(frame),)) for part in parts
+            ])
+        if isinstance(node, ast.UnaryOp):
+            operand = self._compile(node.operand)
+            if isinstance(node.op, ast.Not):
+                return lambda frame: ~np.asarray(operand(frame), dtype=bool)
+            if isinstance(node.op, ast.USub):
+                return lambda frame: -operand(frame)
+            if isinstance(node.op, ast.UAdd):
+                return operand
+        if isinstance(node, ast.Compare):
+            # Chained comparisons (a < b < c) are a pairwise and
+            operands = [self._compile(value) for value in [node.left] + node.comparators]
+            ops = []
+            for op in node.ops:
+                if type(op) not in COMPARISONS:
+                    raise ScreenError(f"Unsupported comparison: {type(op).__name__}")
+                ops.append(COMPARISONS[type(op)])
+            def compare(frame):
+                values = [operand(frame) for operand in operands]
+                mask = None
+                for op, left, right in zip(ops, values, values[1:]):
+                    result = np.asarray(op(left, right), dtype=bool)
+                    mask = result if mask is None else mask & result
+                return mask
+            return compare
+        if isinstance(node, ast.BinOp):
+            if type(node.op) not in ARITHMETIC:
+                raise ScreenError(f"Unsupported operator: {type(node.op).__name__}")
+            op = ARITHMETIC[type(node.op)]
+            left, right = self._compile(node.left), self._compile(node.right)
+            def arithmetic(frame):
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    return op(left(frame), right(frame))
+            return arithmetic
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            # Resolved against the table when evaluated
+            name = node.value
+            return lambda frame: frame.get(name, name)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            # As float64 so constant arithmetic follows array rules (1/0 is inf)
+            value = np.float64(node.value)
+            return lambda frame: value
+        if isinstance(node, ast.Name):
+            name = node.id
+            def column(frame):
+                if name not in frame:
+                    raise ScreenError(f"Unknown column: {name}")
+                return frame[name]
+            return column
+        raise ScreenError(f"Unsupported expression: {ast.unparse(node)}")
+
+    def mask(self, metrics_df):
+        # Boolean array over the rows of the table
+        frame = _Columns(metrics_df)
+        try:
+            with span('screen_mask'):
+                mask = np.asarray(self._evaluate(frame))
+        except (TypeError, ValueError, ZeroDivisionError) as e:
+            # Usually a misspelt quoted column compared as text with a number
+            raise ScreenError(f"Cannot evaluate the expression ({e}); check that column names match the table") from e
+        if mask.dtype != bool or mask.shape != (len(metrics_df),):
+            raise ScreenError("The expression must compare columns, e.g. \"PE Ratio\" < 20")
+        return mask
+
+class _Columns:
+    # Column arrays of a table, converted on first use. Numeric columns are
+    # float64 so missing values are NaN; text columns stay as objects.
+
+    def __init__(self, metrics_df):
+        self._frame = metrics_df
+        self._arrays = {}
+
+    def __len__(self):
+        return len(self._frame)
+
+    def __contains__(self, name):
+        return name in self._frame.columns or name == self._frame.index.name
+
+    def get(self, name, default):
+        return self[name] if name in self else default
+
+    def __getitem__(self, name):
+        if name not in self._arrays:
+            series = self._frame.index.to_series() if name not in self._frame.columns else self._frame[name]
+            if pd.api.types.is_numeric_dtype(series):
+                self._arrays[name] = series.to_numpy(dtype=float, na_value=np.nan)
+            else:
+                self._arrays[name] = series.to_numpy(dtype=object)
+        return self._arrays[name]
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+def compile_screen(expression):
+    # Parses an expression once and memoizes the compiled screen on its text
+    key = expression.strip()
+    with _memo_lock:
+        if key in _memo:
+            _memo.move_to_end(key)
+            inc('screen_memo_hits')
+            return _memo[key]
+    screen = Screen(key)
+    with _memo_lock:
+        _memo[key] = screen
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return screen
+
+def top_n(values, n, largest=True, candidates=None):
+    # Positions of the n best non-missing values, best first, by partial
+    # selection: only the selected n are sorted. candidates restricts the
+    # search to those positions.
+    positions = np.arange(len(values)) if candidates is None else np.asarray(candidates)
+    keys = values[positions]
+    present = ~np.isnan(keys)
+    positions, keys = positions[present], keys[present]
+    if largest:
+        keys = -keys
+    if n <= 0:
+        return positions[:0]
+    if n < len(keys):
+        selected = np.argpartition(keys, n - 1)[:n]
+        positions, keys = positions[selected], keys[selected]
+    return positions[np.argsort(keys, kind='stable')]
+
+def ranks_largest_first(column):
+    # Higher-is-better for the total score and metrics scored that way
+    threshold = METRIC_THRESHOLDS.get(column)
+    return threshold.higher_is_better if threshold is not None else True
+
+def run_screen(metrics_df, expression='', rank_by=None, n=None, largest=None):
+    # Row positions of metrics_df matching the expression (all rows when it
+    # is empty), ranked by a column or the total score and cut to the top n.
+    # Without rank_by the rows keep table order.
+    rows = np.flatnonzero(compile_screen(expression).mask(metrics_df)) if expression.strip() else np.arange(len(metrics_df))
+    inc('screen_rows', len(rows))
+    if rank_by is None:
+        return rows if n is None else rows[:n]
+    if rank_by == TOTAL_SCORE and TOTAL_SCORE not in metrics_df.columns:
+        values = score_metrics_frame(metrics_df)[TOTAL_SCORE].to_numpy(dtype=float)
+    elif rank_by in metrics_df.columns:
+        values = metrics_df[rank_by].to_numpy(dtype=float, na_value=np.nan)
+    else:
+        raise ScreenError(f"Unknown column: {rank_by}")
+    largest = ranks_largest_first(rank_by) if largest is None else largest
+    with span('screen_rank'):
+        return top_n(values, len(rows) if n is None else n, largest, candidates=rows)
@@ -0,0 +1,153 @@
+# shared_store.py
+
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, wait
+
+from instrumentation import inc
+
+# Views derived from tables (scored tables, styled tables, charts) kept per
+# process, overridable through an environment variable
+DERIVED_MEMO_SIZE = int(os.environ.get('AI_FUND_DERIVED_MEMO_SIZE', 64))
+
+class SingleFlight:
+    # Deduplicates concurrent calls by key: the first caller runs the call and
+    # every caller that arrives while it is in flight waits for its result
+    # instead of making the same upstream request again
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            inc('single_flight_shared')
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def do_many(self, keys, fn):
+        # Runs fn(owned_keys) for the keys nobody else is working on, which must
+        # return {key: result}, then waits for the keys other callers own.
+        # Returns {key: result} for the keys whose calls succeeded.
+        owned, shared = [], {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                future = self._calls.get(key)
+                if future is None:
+                    self._calls[key] = Future()
+                    owned.append(key)
+                else:
+                    shared[key] = future
+        if shared:
+            inc('single_flight_shared', len(shared))
+        results = {}
+        if owned:
+            futures = [self._calls[key] for key in owned]
+            try:
+                results = fn(owned)
+            except BaseException as e:
+                for future in futures:
+                    future.set_exception(e)
+                raise
+            else:
+                for key, future in zip(owned, futures):
+                    future.set_result(results.get(key))
+            finally:
+                with self._lock:
+                    for key in owned:
+                        del self._calls[key]
+        wait(shared.values())
+        for key, future in shared.items():
+            if future.exception() is None:
+                results[key] = future.result()
+        return results
+
+class FrameInterner:
+    # Keeps one copy of each distinct DataFrame content per process. Sessions
+    # showing the same tickers end up holding references to the same frame, so
+    # memory grows with the number of distinct tables rather than with the
+    # number of connected users. Frames are only referenced weakly and are
+    # freed when no session holds them; callers must treat them as read-only.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frames = weakref.WeakValueDictionary()
+
+    def intern(self, df):
+        from exports import frame_hash
+
+        key = frame_hash(df)
+        with self._lock:
+            shared = self._frames.get(key)
+            if shared is not None:
+                inc('frames_interned')
+                return shared
+            self._frames[key] = df
+            return df
+
+    def __len__(self):
+        return len(self._frames)
+
+class DerivedViews:
+    # Bounded LRU of views derived from a table, keyed on the table's content
+    # hash and whatever else a view depends on, so sessions showing the same
+    # data share one copy and only hold its key. Views are shared between
+    # threads and must be treated as read-only; pandas Stylers recompute
+    # their styles when rendered, so renders of a shared one hold
+    # render_lock.
+
+    def __init__(self, size=DERIVED_MEMO_SIZE):
+        self.size = size
+        self.render_lock = threading.Lock()
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name, key, build):
+        key = (name, key)
+        with self._lock:
+            if key in self._views:
+                self._views.move_to_end(key)
+                inc('derived_memo', artefact=name, outcome='hit')
+                return self._views[key]
+        inc('derived_memo', artefact=name, outcome='miss')
+        view = build()
+        with self._lock:
+            self._views[key] = view
+            while len(self._views) > self.size:
+                self._views.popitem(last=False)
+        return view
+
+    def __len__(self):
+        return len(self._views)
+
+_flight = SingleFlight()
+_interner = FrameInterner()
+_derived = DerivedViews()
+
+def get_single_flight():
+    # Process-wide single-flight group shared by all sessions
+    return _flight
+
+def intern_frame(df):
+    return _interner.intern(df)
+
+def get_derived_views():
+    # Process-wide derived views shared by all sessions
+    return _derived
@@ -0,0 +1,236 @@
+# snapshot_store.py
+
+import os
+import time
+import uuid
+import atexit
+import threading
+from multiprocessing.util import Finalize
+
+import numpy as np
+import pandas as pd
+
+from metrics_table import as_record, NUMERIC_COLUMNS
+from instrumentation import span, inc
+
+# Store settings, overridable through environment variables
+SNAPSHOT_PATH = os.environ.get('AI_FUND_SNAPSHOT_PATH', os.path.join('.cache', 'snapshots'))
+SNAPSHOT_HISTORY = os.environ.get('AI_FUND_SNAPSHOT_HISTORY', '1').lower() in ('1', 'true', 'yes')
+FLUSH_ROWS = 500  # buffered snapshots written as one file
+FLUSH_INTERVAL = 60.0  # seconds before buffered snapshots are written regardless
+
+def _schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [('ticker', pa.string()), ('fetched_at', pa.timestamp('ms'))]
+        + [(col, pa.float64()) for col in NUMERIC_COLUMNS]
+        + [('Sector', pa.string()), ('Industry', pa.string())]
+    )
+
+class SnapshotStore:
+    # Append-only history of every fetched metrics snapshot, as Parquet files
+    # partitioned by fetch date:
+    #   <root>/date=YYYY-MM-DD/part-<id>.parquet
+    # Snapshots are buffered and written in batches, each file sorted by ticker
+    # so row group statistics let ticker filters skip data. Past days are
+    # compacted into one file per day. Queries read only the requested
+    # columns and the partitions inside the date range.
+
+    def __init__(self, root=SNAPSHOT_PATH, flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL):
+        self.root = root
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def append(self, ticker, metrics, fetched_at=None):
+        record = as_record(metrics)
+        row = (ticker, time.time() if fetched_at is None else fetched_at, record)
+        with self._lock:
+            self._buffer.append(row)
+            due = len(self._buffer) >= self.flush_rows or time.monotonic() - self._flushed_at > self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        # Writes buffered snapshots, one file per fetch date
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            self._flushed_at = time.monotonic()
+        if not rows:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        rows.sort(key=lambda row: (row[0], row[1]))
+        fetched_at = np.array([row[1] for row in rows])
+        dates = pd.to_datetime(fetched_at, unit='s').strftime('%Y-%m-%d').to_numpy()
+        values = np.array([row[2].values for row in rows], dtype=np.float64).reshape(len(rows), len(NUMERIC_COLUMNS))
+        with span('snapshot_flush'):
+            for date in np.unique(dates):
+                mask = dates == date
+                selected = [row for row, keep in zip(rows, mask) if keep]
+                columns = {
+                    'ticker': [row[0] for row in selected],
+                    'fetched_at': (fetched_at[mask] * 1000).astype('int64').astype('datetime64[ms]'),
+                }
+                for j, col in enumerate(NUMERIC_COLUMNS):
+                    columns[col] = values[mask, j]
+                columns['Sector'] = [row[2].sector for row in selected]
+                columns['Industry'] = [row[2].industry for row in selected]
+                table = pa.table(columns, schema=_schema())
+                directory = os.path.join(self.root, f'date={date}')
+                os.makedirs(directory, exist_ok=True)
+                name = f'part-{uuid.uuid4().hex}.parquet'
+                # Written under a name datasets ignore, so readers never see a partial file
+                pq.write_table(table, os.path.join(directory, '_' + name))
+                os.replace(os.path.join(directory, '_' + name), os.path.join(directory, name))
+        inc('snapshots_written', len(rows))
+        self.compact()
+
+    def _parts(self, directory):
+        return sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.startswith('part-') and name.endswith('.parquet')
+        )
+
+    def compact(self):
+        # Merges the files of every finished day into one, so small batches do
+        # not pile up. A lock file keeps concurrent processes from compacting
+        # the same day twice.
+        if not os.path.isdir(self.root):
+            return
+        import pyarrow.parquet as pq
+
+        today = f"date={time.strftime('%Y-%m-%d', time.gmtime())}"
+        for name in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, name)
+            if not name.startswith('date=') or name >= today:
+                continue
+            parts = self._parts(directory)
+            if len(parts) < 2:
+                continue
+            lock_path = os.path.join(directory, '_compact.lock')
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL))
+            except FileExistsError:
+                continue
+            try:
+                # The date= directory is not read back as a column, so the
+                # compacted file has the same schema as the flushed parts
+                table = pq.ParquetDataset(parts, schema=_schema(), partitioning=None).read().sort_by([('ticker', 'ascending'), ('fetched_at', 'ascending')])
+                name = f'part-{uuid.uuid4().hex}.parquet'
+                pq.write_table(table, os.path.join(directory, '_' + name))
+                os.replace(os.path.join(directory, '_' + name), os.path.join(directory, name))
+                for part in parts:
+                    os.remove(part)
+                inc('snapshot_compactions')
+            finally:
+                os.remove(lock_path)
+
+    def query(self, tickers=None, columns=None, start=None, end=None):
+        # Returns [ticker, fetched_at, *columns] for snapshots of the given
+        # tickers fetched between start and end (dates or timestamps,
+        # inclusive), sorted by ticker and time. Date bounds prune partitions;
+        # the ticker filter is pushed down to the row groups. Snapshots still
+        # buffered are served from memory rather than flushed, so reads do not
+        # leave small files behind.
+        columns = list(NUMERIC_COLUMNS if columns is None else columns)
+        output = ['ticker', 'fetched_at'] + columns
+        if start is not None:
+            start = pd.Timestamp(start).floor('ms')
+        if end is not None:
+            end = pd.Timestamp(end).floor('ms')
+            if end == end.normalize():
+                # A bare date includes the whole day
+                end = end + pd.Timedelta(days=1) - pd.Timedelta(milliseconds=1)
+        frames = [self._query_files(tickers, output, start, end), self._query_buffer(tickers, output, start, end)]
+        frames = [frame for frame in frames if frame is not None and not frame.empty]
+        if not frames:
+            return pd.DataFrame(columns=output)
+        frame = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        # A reader racing a compaction or a flush can see rows twice
+        frame = frame.drop_duplicates(['ticker', 'fetched_at'])
+        return frame.sort_values(['ticker', 'fetched_at'], ignore_index=True)
+
+    def _query_files(self, tickers, output, start, end):
+        if not os.path.isdir(self.root) or not any(name.startswith('date=') for name in os.listdir(self.root)):
+            return None
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(
+            self.root,
+            schema=_schema().append(pa.field('date', pa.string())),
+            format='parquet',
+            partitioning=ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive'),
+            exclude_invalid_files=False,
+        )
+        conditions = []
+        if tickers is not None:
+            conditions.append(ds.field('ticker').isin(list(tickers)))
+        if start is not None:
+            conditions.append(ds.field('date') >= start.strftime('%Y-%m-%d'))
+            conditions.append(ds.field('fetched_at') >= pa.scalar(start.to_pydatetime(), pa.timestamp('ms')))
+        if end is not None:
+            conditions.append(ds.field('date') <= end.strftime('%Y-%m-%d'))
+            conditions.append(ds.field('fetched_at') <= pa.scalar(end.to_pydatetime(), pa.timestamp('ms')))
+        condition = None
+        for expression in conditions:
+            condition = expression if condition is None else condition & expression
+        with span('snapshot_query'):
+            table = dataset.to_table(columns=output, filter=condition)
+        return table.to_pandas()
+
+    def _query_buffer(self, tickers, output, start, end):
+        with self._lock:
+            rows = list(self._buffer)
+        if tickers is not None:
+            wanted = set(tickers)
+            rows = [row for row in rows if row[0] in wanted]
+        if not rows:
+            return None
+        frame = pd.DataFrame({
+            'ticker': [row[0] for row in rows],
+            'fetched_at': (np.array([row[1] for row in rows]) * 1000).astype('int64').astype('datetime64[ms]'),
+        })
+        for col in output[2:]:
+            if col == 'Sector':
+                frame[col] = [row[2].sector for row in rows]
+            elif col == 'Industry':
+                frame[col] = [row[2].industry for row in rows]
+            else:
+                j = NUMERIC_COLUMNS.index(col)
+                frame[col] = np.array([row[2].values[j] for row in rows], dtype=np.float64)
+        keep = np.ones(len(frame), dtype=bool)
+        if start is not None:
+            keep &= frame['fetched_at'] >= start
+        if end is not None:
+            keep &= frame['fetched_at'] <= end
+        return frame[keep]
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_snapshot_store():
+    # Process-wide store, created on first use. Buffered snapshots are flushed
+    # at interpreter exit and when a multiprocessing worker exits.
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SnapshotStore()
+            atexit.register(_store.flush)
+            Finalize(None, _store.flush, exitpriority=10)
+        return _store
+
+def set_snapshot_store(store):
+    global _store
+    with _store_lock:
+        _store = store
+
+def record_snapshot(ticker, metrics):
+    # Called for every snapshot fetched from upstream
+    if SNAPSHOT_HISTORY:
+        get_snapshot_store().append(ticker, metrics)
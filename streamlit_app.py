@@ -1,148 +1,557 @@
 # streamlit_app.py
 
+import time
 import streamlit as st
 import pandas as pd
 import numpy as np
-import seaborn as sns
 from streamlit_tags import st_tags_sidebar
-import plotly.express as px
-import yfinance as yf
-from io import BytesIO
-import xlsxwriter
+from functools import partial
 
 from finance_data import get_stock_data
+from fetch_engine import fetch_stock_data_concurrently
+from metrics_table import MetricsTableBuilder, concat_metrics_frames
+from exports import EXPORT_FORMATS, frame_hash, export_bytes
+from request_scheduler import CircuitOpen, SymbolNotFound
+from shared_store import intern_frame, get_derived_views
+from metrics_cache import get_metrics_cache
+from refresher import get_refresher
+from watchlists import DEFAULT_TICKERS
+from instrumentation import registry, span, inc, observe_ticker, METRICS_FILE
 from explanations import metric_explanations
-
-# Define color coding functions for each metric
-def color_pe_ratio(val):
-    if pd.isnull(val):
-        return ''
-    elif val < 20:
-        color = 'green'
-    elif 20 <= val <= 25:
-        color = 'orange'
-    else:
-        color = 'red'
-    return f'background-color: {color}'
-
-def color_peg_ratio(val):
-    if pd.isnull(val):
-        return ''
-    elif val < 1:
-        color = 'green'
-    elif 1 <= val <= 1.25:
-        color = 'orange'
-    else:
-        color = 'red'
-    return f'background-color: {color}'
-
-def color_ps_ratio(val):
-    if pd.isnull(val):
-        return ''
-    elif val < 1:
-        color = 'green'
-    elif 1 <= val <= 3:
-        color = 'orange'
+from evaluations import METRIC_THRESHOLDS, SCORED_METRICS, metric_bands, peer_bands, score_metrics_frame, evaluate_metrics
+from peer_index import get_peer_index, MIN_PEERS
+from snapshot_store import get_snapshot_store
+from screening import run_screen, ranks_largest_first, ScreenError, TOTAL_SCORE
+from table_view import TableView, PAGED_TABLE_ROWS, PAGE_SIZES
+from downsampling import downsampled_closes, chart_intervals, CHART_PERIODS, CHART_INTERVALS
+from risk import update_risk_model, RISK_PERIOD
+from price_history import get_price_history_store
+from indicators import get_indicator_engine, INDICATOR_COLUMNS, BENCHMARK, SMA_WINDOWS, VOLATILITY_WINDOW, BETA_WINDOW
+
+# Concurrency settings used when refreshing ticker data
+FETCH_MAX_WORKERS = 8
+FETCH_TICKER_TIMEOUT = 20  # seconds
+PARTIAL_RENDER_INTERVAL = 0.5  # seconds between partial table redraws
+
+# Portfolio risk starts with the first few tickers of a watchlist, and the
+# correlation heatmap shows at most this many of the largest risk contributors
+RISK_DEFAULT_TICKERS = 20
+CORRELATION_HEATMAP_MAX = 50
+
+# How failed tickers are grouped in the fetch summary
+FAILURE_LABELS = {
+    'timeout': "Timed out",
+    'skipped': "Skipped after repeated failures",
+    'not_found': "Not found or delisted",
+    'error': "Errors",
+}
+
+def failure_reason(error):
+    # get_stock_data chains the underlying scheduler error as the cause
+    cause = error.__cause__ or error
+    if isinstance(error, TimeoutError):
+        return 'timeout'
+    if isinstance(cause, CircuitOpen):
+        return 'skipped'
+    if isinstance(cause, SymbolNotFound):
+        return 'not_found'
+    return 'error'
+
+# Display formats of the table columns
+TABLE_FORMATS = {
+    'Current Price ($)': '${:,.2f}',
+    'PE Ratio': '{:.2f}',
+    'PEG Ratio': '{:.2f}',
+    'Price-to-Sales Ratio': '{:.2f}',
+    'Forward PE': '{:.2f}',
+    'Price-to-Book Ratio': '{:.2f}',
+    'EV/EBITDA Ratio': '{:.2f}',
+    'Dividend Yield (%)': '{:.2f}%',
+    'Return on Equity (%)': '{:.2f}%',
+    'Earnings Per Share ($)': '${:,.2f}',
+    'Debt-to-Equity Ratio': '{:.2f}',
+    'Profit Margin (%)': '{:.2f}%',
+    'Beta': '{:.2f}',
+    'Total Score': '{:+d}',
+    'Volatility (%)': '{:.1f}%',
+    'Max Drawdown (%)': '{:.1f}%',
+    'Momentum 6M (%)': '{:+.1f}%',
+    'vs 200D SMA (%)': '{:+.1f}%',
+    'Rolling Beta': '{:.2f}',
+}
+
+# Metrics offered by the comparison and trend charts
+METRIC_OPTIONS = [
+    'PE Ratio',
+    'PEG Ratio',
+    'Price-to-Sales Ratio',
+    'Forward PE',
+    'Price-to-Book Ratio',
+    'EV/EBITDA Ratio',
+    'Dividend Yield (%)',
+    'Return on Equity (%)',
+    'Earnings Per Share ($)',
+    'Debt-to-Equity Ratio',
+    'Profit Margin (%)',
+    'Beta'
+]
+
+# CSS background for each evaluation band; missing values stay unstyled
+BAND_BACKGROUNDS = np.array(['', 'background-color: green', 'background-color: orange', 'background-color: red'])
+
+def color_metrics(df, bands=None):
+    # Background colours for every column that has thresholds, computed in one
+    # vectorized pass for use with Styler.apply(axis=None). Precomputed bands,
+    # e.g. peer-relative ones, can be passed for those columns in table order.
+    styles = np.full(df.shape, '', dtype=object)
+    columns = [col for col in df.columns if col in METRIC_THRESHOLDS]
+    if columns:
+        if bands is None:
+            bands = metric_bands(df[columns].to_numpy(dtype=float, na_value=np.nan), columns)
+        styles[:, [df.columns.get_loc(col) for col in columns]] = BAND_BACKGROUNDS[bands]
+    return pd.DataFrame(styles, index=df.index, columns=df.columns)
+
+def peer_summary(peer_index, row):
+    # Peer group and median for each scored metric of one ticker
+    parts = []
+    for col in SCORED_METRICS:
+        group = peer_index.peer_group(row['Sector'], row['Industry'], col)
+        if group is None:
+            continue
+        level, name = group
+        median = peer_index.median(level, name, col)
+        parts.append(f"{col} {name if level != 'Universe' else 'all tickers'} median {median:.2f}")
+    if not parts:
+        return f"Too few peers cached to compare against (at least {MIN_PEERS} needed)."
+    return "Peer medians: " + "; ".join(parts) + "."
+
+def format_age(seconds):
+    if seconds < 90:
+        return f"{seconds:.0f}s"
+    if seconds < 90 * 60:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+def snapshot_age_caption(snapshot_times, refresher):
+    # How old the data behind the table is, and whether it is kept fresh
+    now = time.time()
+    oldest = min(snapshot_times, key=snapshot_times.get)
+    caption = f"Data as of {format_age(now - max(snapshot_times.values()))} ago"
+    if len(snapshot_times) > 1:
+        caption += f"; oldest snapshot {format_age(now - snapshot_times[oldest])} ({oldest})"
+    if refresher is not None and refresher.running:
+        caption += f". Refreshed in the background every {format_age(refresher.interval)}; use Refresh Data to fetch now."
+    return caption
+
+def paged_table(metrics_df, bands, key):
+    # Sort, filter and page controls for a large table. Returns the rows of
+    # the current page and their bands; the view and its sort orders are
+    # shared by every session showing the same table.
+    view = get_derived_views().get('table_view', key, lambda: TableView(metrics_df, key=key))
+
+    sort_column, order_column, search_column, size_column = st.columns(4)
+    sort = sort_column.selectbox("Sort By", ['Ticker'] + view.columns, key='table_sort')
+    descending = order_column.selectbox("Order", ["Ascending", "Descending"], key='table_order') == "Descending"
+    search = search_column.text_input("Ticker Contains", key='table_search')
+    page_size = size_column.selectbox("Rows Per Page", PAGE_SIZES, index=1, key='table_page_size')
+    ranges = {}
+    for col in st.multiselect("Filter Columns", view.columns, key='table_filters'):
+        bounds = view.bounds(col)
+        if bounds is not None and bounds[0] < bounds[1]:
+            ranges[col] = st.slider(col, bounds[0], bounds[1], bounds, key=f'table_range_{col}')
+
+    rows = view.rows(None if sort == 'Ticker' else sort, descending, ranges, search)
+    pages = view.page_count(rows, page_size)
+    # Filtering can leave the current page past the end
+    if st.session_state.get('table_page', 1) > pages:
+        st.session_state.table_page = pages
+    number = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key='table_page')
+    page_rows = view.page(rows, number, page_size)
+    if len(rows):
+        first = (number - 1) * page_size + 1
+        st.caption(f"Showing {first}-{first + len(page_rows) - 1} of {len(rows)} matching tickers ({len(view)} in total)")
     else:
-        color = 'red'
-    return f'background-color: {color}'
-
-def color_roe(val):
-    if pd.isnull(val):
-        return ''
-    elif val > 15:
-        color = 'green'
-    elif 10 <= val <= 15:
-        color = 'orange'
-    else:
-        color = 'red'
-    return f'background-color: {color}'
-
-def color_de_ratio(val):
-    if pd.isnull(val):
-        return ''
-    elif val < 1:
-        color = 'green'
-    elif 1 <= val <= 2:
-        color = 'orange'
-    else:
-        color = 'red'
-    return f'background-color: {color}'
-
-def color_profit_margin(val):
-    if pd.isnull(val):
-        return ''
-    elif val > 20:
-        color = 'green'
-    elif 10 <= val <= 20:
-        color = 'orange'
+        st.caption(f"No tickers match the filters ({len(view)} in total)")
+    return metrics_df.iloc[page_rows], None if bands is None else bands[page_rows]
+
+def set_metrics_df(frame):
+    # Stores a newly fetched table. Its content hash is the data version that
+    # derived views are memoized on; it only changes when the content does,
+    # so a refresh that returns the same numbers keeps every view.
+    content = frame_hash(frame)
+    if content != st.session_state.get('metrics_hash'):
+        st.session_state.metrics_hash = content
+        inc('data_versions')
+    # Sessions with the same table share one read-only copy
+    st.session_state.metrics_df = intern_frame(frame)
+
+def memoized(name, key, build):
+    # Derived views are kept per process on their key, not per session, so
+    # sessions showing the same data share them
+    return get_derived_views().get(name, key, build)
+
+def build_table(peer_relative, show_indicators):
+    # The displayed table: scores (fixed or peer-relative), optional
+    # indicator columns and the colour bands of the thresholded columns
+    metrics_df = st.session_state.metrics_df.set_index('Ticker')
+    threshold_columns = [col for col in metrics_df.columns if col in METRIC_THRESHOLDS]
+    bands = None
+    if peer_relative:
+        bands = peer_bands(get_peer_index().percentile_ranks(metrics_df, threshold_columns), threshold_columns)
+
+    # Score every ticker in one vectorized pass
+    scored_bands = None if bands is None else bands[:, [threshold_columns.index(col) for col in SCORED_METRICS]]
+    metrics_df['Total Score'] = score_metrics_frame(metrics_df, bands=scored_bands)['Total Score']
+
+    # Optional columns computed from stored price history; they are not scored
+    if show_indicators:
+        indicators = get_indicator_engine().compute(list(metrics_df.index))
+        metrics_df = metrics_df.join(indicators.summary[INDICATOR_COLUMNS])
+    return metrics_df, bands
+
+def style_table(table_df, bands):
+    with span('style_table'):
+        # Create a Styler object with formatting
+        styled_df = table_df.style.format(TABLE_FORMATS, na_rep='N/A')
+
+        # Apply conditional formatting
+        return styled_df.apply(color_metrics, axis=None, bands=bands)
+
+@st.fragment
+def comparison_table(metrics_df, bands, table_key):
+    # Large tables are sorted and filtered here and only the visible page
+    # is styled and rendered; paging reruns only this fragment
+    if len(metrics_df) > PAGED_TABLE_ROWS:
+        table_df, table_bands = paged_table(metrics_df, bands, table_key)
+        styled_df = memoized('styled_page', (table_key, tuple(table_df.index)), lambda: style_table(table_df, table_bands))
     else:
-        color = 'red'
-    return f'background-color: {color}'
-
-def color_ev_ebitda(val):
-    if pd.isnull(val):
-        return ''
-    elif val < 10:
-        color = 'green'
-    elif 10 <= val <= 14:
-        color = 'orange'
+        styled_df = memoized('styled_table', table_key, lambda: style_table(metrics_df, bands))
+    with get_derived_views().render_lock:
+        st.write(styled_df)
+
+@st.fragment
+def export_section():
+    # Exports are only generated on request and memoized on the table's content
+    export_format = st.selectbox("Export Format", list(EXPORT_FORMATS))
+    extension, mime = EXPORT_FORMATS[export_format]
+    export_key = (st.session_state.metrics_hash, extension)
+    if st.button("Prepare Export"):
+        st.session_state.prepared_export = export_key
+    if st.session_state.get('prepared_export') == export_key:
+        st.download_button(
+            label=f"📥 Export data to {export_format}",
+            data=export_bytes(st.session_state.metrics_df, extension, content_hash=export_key[0]),
+            file_name=f'stock_metrics.{extension}',
+            mime=mime
+        )
+
+@st.fragment
+def screener_section(metrics_df, bands):
+    st.header("Stock Screener")
+    screen_expression = st.text_input(
+        "Screening Expression",
+        placeholder='"PE Ratio" < 20 and "Return on Equity (%)" > 15',
+        help='Quote column names that contain spaces or symbols. Combine conditions with and, or and not; '
+             'text columns compare with quoted values, e.g. Sector == "Technology".'
+    )
+    rank_column, order_column, count_column = st.columns(3)
+    rank_options = [TOTAL_SCORE] + [col for col in metrics_df.columns if col != TOTAL_SCORE and col in TABLE_FORMATS]
+    rank_by = rank_column.selectbox("Rank By", rank_options)
+    rank_order = order_column.selectbox(
+        "Rank Order", ["Best first", "Highest first", "Lowest first"],
+        help="Best first puts the favourable end of the metric first, e.g. the lowest PE Ratio."
+    )
+    top_count = count_column.number_input("Show Top", min_value=1, value=20, step=5)
+    largest = {"Best first": ranks_largest_first(rank_by), "Highest first": True, "Lowest first": False}[rank_order]
+    try:
+        screen_rows = run_screen(metrics_df, screen_expression, rank_by, int(top_count), largest)
+    except ScreenError as e:
+        st.error(str(e))
     else:
-        color = 'red'
-    return f'background-color: {color}'
-
-def color_forward_pe(val):
-    if pd.isnull(val):
-        return ''
-    elif val < 20:
-        color = 'green'
-    elif 20 <= val <= 25:
-        color = 'orange'
+        if len(screen_rows):
+            st.write(style_table(metrics_df.iloc[screen_rows], None if bands is None else bands[screen_rows]))
+        else:
+            st.info("No tickers match the screen.")
+
+@st.fragment
+def explanation_section():
+    st.header("Metrics Explained")
+    metric_list = list(metric_explanations.keys())
+    choice = st.selectbox(
+        "Select a Metric to Explain",
+        metric_list,
+    )
+    st.write(f"**{choice}:** {metric_explanations[choice]}")
+
+@st.fragment
+def breakdown_section(metrics_df, peer_relative):
+    st.header("Valuation Breakdown")
+    evaluated_ticker = st.selectbox(
+        "Select a Ticker to Evaluate",
+        metrics_df.index
+    )
+    # Messages are only built for the ticker being displayed, against the
+    # same fixed thresholds or peer ranks as its score
+    row = metrics_df.loc[evaluated_ticker]
+    ranks = None
+    if peer_relative:
+        ranks = get_peer_index().percentile_ranks(metrics_df.loc[[evaluated_ticker]], SCORED_METRICS)[0]
+    evaluations, _ = evaluate_metrics(row, ranks)
+    for metric, message, color in zip(evaluations['Metric'], evaluations['Evaluation'], evaluations['Color']):
+        color = 'gray' if color == 'black' else color
+        st.markdown(f"**{metric}:** :{color}[{message}]")
+    st.write(f"**Total Score:** {sum(evaluations['Score']):+d}")
+    if peer_relative:
+        st.caption(peer_summary(get_peer_index(), row))
+
+@st.fragment
+def price_chart_section():
+    st.header("Stock Price History")
+
+    # Dropdown to select a ticker
+    selected_ticker = st.selectbox(
+        "Select a Ticker to View Price Chart",
+        st.session_state.tickers
+    )
+
+    # Optionally overlay other tickers on the same chart
+    compare_tickers = st.multiselect(
+        "Compare With",
+        [ticker for ticker in dict.fromkeys(st.session_state.tickers) if ticker != selected_ticker]
+    )
+    period_column, interval_column = st.columns(2)
+    chart_period = period_column.selectbox(
+        "Period", list(CHART_PERIODS), index=list(CHART_PERIODS).index('1y'), format_func=CHART_PERIODS.get
+    )
+    intervals = chart_intervals(chart_period)
+    chart_interval = interval_column.selectbox(
+        "Interval", intervals, index=intervals.index('1d') if '1d' in intervals else 0,
+        format_func=lambda interval: CHART_INTERVALS[interval][0]
+    )
+    normalize_prices = st.checkbox("Normalize prices to 100 at the start of the period")
+    overlays = st.multiselect(
+        "Indicator Overlays",
+        [f"{window}-day average" for window in SMA_WINDOWS] + ["Rolling volatility", "Rolling beta"],
+        disabled=chart_interval != '1d',
+        help="Indicators are computed from daily bars over the last two years, so they need the daily interval."
+    )
+    if chart_interval != '1d':
+        overlays = []
+
+    # Read historical data for the chart tickers from the local store, which
+    # only downloads bars newer than the last stored ones, in batched
+    # requests. Each line is cut to a fixed point budget before plotting.
+    chart_tickers = [selected_ticker] + compare_tickers
+    closes = downsampled_closes(chart_tickers, period=chart_period, interval=chart_interval)
+    closes = {ticker: close for ticker, close in closes.items() if not close.empty}
+
+    if selected_ticker in closes:
+        # Plotly is only imported once a chart is drawn
+        import plotly.express as px
+
+        price_label = 'Closing Price ($)'
+        scale = {ticker: 1.0 for ticker in closes}
+        if normalize_prices:
+            scale = {ticker: 100 / close.iloc[0] for ticker, close in closes.items()}
+            price_label = 'Normalized Closing Price'
+        price_lines = pd.concat(
+            {ticker: close * scale[ticker] for ticker, close in closes.items()}, names=['Ticker', 'Date']
+        ).rename('Close').reset_index()
+        period_label = CHART_PERIODS[chart_period].lower()
+        if compare_tickers:
+            title = f"Closing Prices, {period_label}"
+        else:
+            title = f"{selected_ticker} Closing Price, {period_label}"
+        fig_price = px.line(
+            price_lines,
+            x='Date',
+            y='Close',
+            color='Ticker',
+            title=title,
+            labels={'Close': price_label, 'Date': 'Date', 'Ticker': 'Ticker'}
+        )
+        chart_start = price_lines['Date'].min()
+        if overlays:
+            indicators = get_indicator_engine().compute(list(closes))
+            # Moving averages are drawn on the price axis, in the same scale as the prices
+            for window in SMA_WINDOWS:
+                if f"{window}-day average" in overlays:
+                    sma = indicators.sma[window][indicators.sma[window].index >= chart_start]
+                    for ticker in closes:
+                        fig_price.add_scatter(x=sma.index, y=sma[ticker] * scale[ticker], mode='lines',
+                                              line={'dash': 'dot'}, name=f"{ticker} {window}D avg")
+        st.plotly_chart(fig_price, use_container_width=True)
+
+        # Rolling risk measures have their own axes
+        for overlay, series, label in [
+            ("Rolling volatility", 'volatility', f'Annualized Volatility, {VOLATILITY_WINDOW}-day'),
+            ("Rolling beta", 'beta', f'Beta vs {BENCHMARK}, {BETA_WINDOW}-day'),
+        ]:
+            if overlay in overlays:
+                frame = getattr(indicators, series)
+                frame = frame[frame.index >= chart_start][list(closes)]
+                fig_overlay = px.line(frame, x=frame.index, y=list(closes), title=label,
+                                      labels={'value': label, 'Date': 'Date', 'Ticker': 'Ticker'})
+                st.plotly_chart(fig_overlay, use_container_width=True)
     else:
-        color = 'red'
-    return f'background-color: {color}'
-
-def color_pb_ratio(val):
-    if pd.isnull(val):
-        return ''
-    elif val < 1:
-        color = 'green'
-    elif 1 <= val <= 3:
-        color = 'orange'
+        st.warning(f"No historical data available for {selected_ticker}.")
+
+@st.fragment
+def metric_chart_section():
+    st.header("Metric Comparison Among Selected Stocks")
+
+    selected_metric = st.selectbox(
+        "Select a Metric to Compare Across Stocks",
+        METRIC_OPTIONS
+    )
+
+    def build_chart():
+        # Filter data for the selected metric
+        metric_data = st.session_state.metrics_df[['Ticker', selected_metric]].dropna()
+        if metric_data.empty:
+            return None
+
+        # Create a bar chart using Plotly
+        import plotly.express as px
+
+        return px.bar(
+            metric_data,
+            x='Ticker',
+            y=selected_metric,
+            title=f"Comparison of {selected_metric} Across Selected Stocks",
+            labels={'Ticker': 'Ticker', selected_metric: selected_metric}
+        )
+
+    # The figure is rebuilt only when the data or the metric changes
+    fig_metric = memoized('metric_chart', (st.session_state.metrics_hash, selected_metric), build_chart)
+    if fig_metric is not None:
+        st.plotly_chart(fig_metric, use_container_width=True)
     else:
-        color = 'red'
-    return f'background-color: {color}'
-
-def color_dividend_yield(val):
-    if pd.isnull(val):
-        return ''
-    elif val > 3:
-        color = 'green'
-    elif 1 <= val <= 3:
-        color = 'orange'
+        st.warning(f"No data available for {selected_metric}.")
+
+@st.fragment
+def trend_section():
+    st.header("Metric Trend Over Time")
+
+    trend_metric = st.selectbox("Select a Metric to Track", METRIC_OPTIONS, key='trend_metric')
+    trend_tickers = st.multiselect(
+        "Tickers to Track",
+        list(dict.fromkeys(st.session_state.tickers)),
+        default=list(dict.fromkeys(st.session_state.tickers))[:5],
+        key='trend_tickers'
+    )
+    today = pd.Timestamp.utcnow().date()
+    trend_range = st.date_input(
+        "Date Range",
+        value=(today - pd.Timedelta(days=90), today),
+        max_value=today,
+        key='trend_range'
+    )
+
+    # Reads only the chosen metric for the chosen tickers, from the date
+    # partitions inside the range
+    if trend_tickers and len(trend_range) == 2:
+        trend_data = get_snapshot_store().query(
+            trend_tickers, [trend_metric], start=trend_range[0], end=trend_range[1]
+        ).dropna()
     else:
-        color = 'red'
-    return f'background-color: {color}'
-
-def color_eps(val):
-    if pd.isnull(val):
-        return ''
-    elif val > 0:
-        color = 'green'
+        trend_data = pd.DataFrame()
+
+    if not trend_data.empty:
+        import plotly.express as px
+
+        fig_trend = px.line(
+            trend_data,
+            x='fetched_at',
+            y=trend_metric,
+            color='ticker',
+            markers=True,
+            title=f"{trend_metric} Over Time",
+            labels={'fetched_at': 'Fetched', 'ticker': 'Ticker', trend_metric: trend_metric}
+        )
+        st.plotly_chart(fig_trend, use_container_width=True)
     else:
-        color = 'red'
-    return f'background-color: {color}'
-
-def color_beta(val):
-    if pd.isnull(val):
-        return ''
-    elif val < 1:
-        color = 'green'
-    elif 1 <= val <= 1.5:
-        color = 'orange'
+        st.warning(f"No stored history of {trend_metric} for the selected tickers and dates.")
+
+@st.fragment
+def risk_section():
+    st.header("Portfolio Risk")
+    risk_tickers = st.multiselect(
+        "Portfolio Tickers",
+        list(dict.fromkeys(st.session_state.tickers)),
+        default=list(dict.fromkeys(st.session_state.tickers))[:RISK_DEFAULT_TICKERS],
+        key='risk_tickers'
+    )
+    if len(risk_tickers) >= 2:
+        # Weights default to equal and are normalized to sum to one; the
+        # editor starts afresh whenever the ticker list changes
+        weights_df = st.data_editor(
+            pd.DataFrame({'Ticker': risk_tickers, 'Weight': 1.0}),
+            hide_index=True,
+            disabled=['Ticker'],
+            column_config={'Weight': st.column_config.NumberColumn(min_value=0.0, step=0.1)},
+            key=f'risk_weights_{hash(tuple(risk_tickers))}'
+        )
+        # The covariance model is kept in the session and updated for
+        # added or removed tickers rather than rebuilt
+        risk_model = update_risk_model(st.session_state.get('risk_model'), risk_tickers)
+        st.session_state.risk_model = risk_model
+        weights = dict(zip(weights_df['Ticker'], weights_df['Weight'].fillna(0.0)))
+        if len(risk_model.dates) and sum(weights.values()) > 0:
+            import plotly.express as px
+
+            volatility, contributions = risk_model.portfolio(weights, risk_tickers)
+            st.metric("Annualized Portfolio Volatility", f"{volatility * 100:.1f}%")
+            # Large portfolios only chart the tickers contributing most risk
+            heatmap_tickers = risk_tickers
+            title = f"Correlation of Daily Returns, {RISK_PERIOD}"
+            if len(risk_tickers) > CORRELATION_HEATMAP_MAX:
+                heatmap_tickers = list(contributions['Risk Contribution'].nlargest(CORRELATION_HEATMAP_MAX).index)
+                title += f", {CORRELATION_HEATMAP_MAX} largest risk contributors"
+            fig_correlation = px.imshow(
+                risk_model.correlation(heatmap_tickers),
+                zmin=-1,
+                zmax=1,
+                color_continuous_scale='RdBu_r',
+                title=title
+            )
+            st.plotly_chart(fig_correlation, use_container_width=True)
+            fig_contribution = px.bar(
+                contributions.reset_index(),
+                x='Ticker',
+                y='Risk Contribution (%)',
+                title="Share of Portfolio Volatility by Ticker"
+            )
+            st.plotly_chart(fig_contribution, use_container_width=True)
+            st.dataframe(contributions.style.format({
+                'Weight': '{:.1%}',
+                'Volatility': '{:.1%}',
+                'Risk Contribution': '{:.2%}',
+                'Risk Contribution (%)': '{:.1f}%',
+            }))
+        else:
+            st.warning("No price history or weights available for the selected tickers.")
     else:
-        color = 'red'
-    return f'background-color: {color}'
+        st.info("Select at least two tickers to analyse portfolio risk.")
+
+def show_diagnostics():
+    diagnostics = registry.snapshot()
+    with st.sidebar.expander("Diagnostics", expanded=True):
+        st.caption("Timings (spans)")
+        st.dataframe(pd.DataFrame(diagnostics['timers']), hide_index=True)
+        st.caption("Counters")
+        st.dataframe(pd.DataFrame(diagnostics['counters']), hide_index=True)
+        st.caption("Recent per-ticker latency")
+        ticker_latency = pd.DataFrame(diagnostics['tickers'])
+        if not ticker_latency.empty:
+            ticker_latency['at'] = pd.to_datetime(ticker_latency['at'], unit='s')
+        st.dataframe(ticker_latency, hide_index=True)
+        st.download_button(
+            label="Download Prometheus metrics",
+            data=registry.to_prometheus(),
+            file_name='ai_fund_metrics.prom',
+            mime='text/plain'
+        )
 
 def main():
     # Set Streamlit page configuration to wide layout
@@ -157,19 +566,14 @@ def main():
 
     # Initialize session state for storing tickers and data
     if 'tickers' not in st.session_state:
-        # List of 20 AI stock tickers
-        st.session_state.tickers = [
-            'NVDA', 'GOOGL', 'MSFT', 'AMZN', 'IBM', 'TSLA', 'META', 'BIDU',
-            'AMD', 'CRM', 'INTC', 'ORCL', 'TWLO', 'PLTR', 'AI', 'PATH',
-            'CGNX'
-        ]
+        st.session_state.tickers = list(DEFAULT_TICKERS)
     if 'metrics_df' not in st.session_state:
         st.session_state.metrics_df = pd.DataFrame()
     if 'prev_tickers' not in st.session_state:
         st.session_state.prev_tickers = []
-
-    # Set Seaborn style
-    sns.set(style="darkgrid")
+    if 'metrics_hash' not in st.session_state:
+        # Content hash of metrics_df; derived views are memoized on it
+        st.session_state.metrics_hash = None
 
     # Set the title of the app
     st.title("University of Exeter AI Fund Stock Comparison")
@@ -190,209 +594,196 @@ def main():
     # Update the tickers in session state based on tag input
     st.session_state.tickers = [ticker.upper() for ticker in ticker_tags]
 
-    # Check if tickers have changed
-    if set(st.session_state.tickers) != set(st.session_state.prev_tickers):
-        # Ticker list has changed; set a flag to indicate data needs to be refreshed
-        st.session_state.data_needs_refresh = True
-        st.session_state.prev_tickers = st.session_state.tickers.copy()
-    else:
-        if 'data_needs_refresh' not in st.session_state:
-            st.session_state.data_needs_refresh = False
+    # While the background refresher keeps snapshots warm, render from the
+    # freshest snapshot of any age and only fetch tickers that have none
+    refresher = get_refresher()
+    snapshot_max_age = float('inf') if refresher is not None and refresher.running else None
+
+    # Define a function to fetch rows for a list of tickers
+    def fetch_rows(tickers, force_refresh=False):
+        builder = MetricsTableBuilder(capacity=len(tickers))
+        failures = {}
+        # Show partial results while the remaining tickers are still loading
+        progress = st.progress(0.0, text="Fetching data...")
+        partial_table = st.empty()
+        last_render = 0.0
+        total = len(set(tickers))
+        with span('fetch_data'):
+            for completed, (ticker, result, error) in enumerate(
+                fetch_stock_data_concurrently(
+                    tickers,
+                    max_workers=FETCH_MAX_WORKERS,
+                    timeout=FETCH_TICKER_TIMEOUT,
+                    fetch=partial(get_stock_data, force_refresh=force_refresh, max_age=snapshot_max_age)
+                ),
+                start=1
+            ):
+                if error is None:
+                    builder.append(ticker, result)
+                    # Redraw the partial table at most a few times per second
+                    if time.monotonic() - last_render > PARTIAL_RENDER_INTERVAL:
+                        partial_table.dataframe(builder.to_frame(), hide_index=True)
+                        last_render = time.monotonic()
+                else:
+                    reason = failure_reason(error)
+                    failures[ticker] = (reason, error)
+                    inc('fetch_failures', reason=reason)
+                    if reason == 'timeout':
+                        observe_ticker(ticker, FETCH_TICKER_TIMEOUT, reason)
+                progress.progress(completed / total, text=f"Fetched {completed} of {total} tickers")
+            progress.empty()
+            partial_table.empty()
+            fetched_data = builder.to_frame()
+        inc('fetch_rows', len(fetched_data))
+        # Keep rows in the order the tickers were entered
+        if not fetched_data.empty:
+            order = {ticker: i for i, ticker in enumerate(tickers)}
+            fetched_data = fetched_data.sort_values(
+                'Ticker', key=lambda s: s.map(order)
+            ).reset_index(drop=True)
+        if failures:
+            # One summary instead of an error box per ticker
+            by_reason = {}
+            for ticker, (reason, error) in failures.items():
+                by_reason.setdefault(reason, []).append(ticker)
+            summary = '; '.join(f"{FAILURE_LABELS[reason]}: {', '.join(names)}" for reason, names in by_reason.items())
+            st.sidebar.warning(f"Failed to fetch data for {len(failures)} of {total} tickers. {summary}")
+            with st.sidebar.expander("Fetch errors"):
+                for ticker, (reason, error) in failures.items():
+                    st.text(f"{ticker}: {error}")
+        else:
+            st.sidebar.success("Data fetched successfully.")
+        return fetched_data
 
-    # Define a function to fetch data
-    def fetch_data():
+    # Define a function to refetch data for every ticker
+    def fetch_data(force_refresh=False):
         if st.session_state.tickers:
-            refreshed_data = pd.DataFrame()
-            failed_tickers = []
-            for ticker in st.session_state.tickers:
-                try:
-                    stock, metrics, sector, industry = get_stock_data(ticker)
-                    metrics_row = {'Ticker': ticker}
-                    metrics_row.update(metrics)
-                    refreshed_data = pd.concat(
-                        [refreshed_data, pd.DataFrame([metrics_row])],
-                        ignore_index=True
-                    )
-                except Exception as e:
-                    failed_tickers.append(ticker)
-                    st.sidebar.error(f"Error fetching data for {ticker}: {e}")
             # Update the session state DataFrame
-            st.session_state.metrics_df = refreshed_data
-            if failed_tickers:
-                st.sidebar.warning(f"Failed to fetch data for: {', '.join(failed_tickers)}")
-            else:
-                st.sidebar.success("Data fetched successfully.")
+            set_metrics_df(fetch_rows(st.session_state.tickers, force_refresh))
             # Reset the refresh flag
             st.session_state.data_needs_refresh = False
 
+    # Define a function to apply a change in the ticker list without refetching unchanged tickers
+    def update_data(added, removed):
+        # The current frame may be shared with other sessions, so build a new one
+        metrics_df = st.session_state.metrics_df
+        if removed:
+            metrics_df = metrics_df[~metrics_df['Ticker'].isin(removed)].reset_index(drop=True)
+        if added:
+            metrics_df = concat_metrics_frames([metrics_df, fetch_rows(added)])
+        set_metrics_df(metrics_df)
+
+    # Check if tickers have changed
+    if set(st.session_state.tickers) != set(st.session_state.prev_tickers):
+        previous = set(st.session_state.prev_tickers)
+        current = set(st.session_state.tickers)
+        st.session_state.prev_tickers = st.session_state.tickers.copy()
+        if st.session_state.metrics_df.empty:
+            # Nothing fetched yet; set a flag to indicate data needs to be refreshed
+            st.session_state.data_needs_refresh = True
+        else:
+            # Only fetch the added tickers and drop the removed ones
+            update_data(
+                added=[ticker for ticker in dict.fromkeys(st.session_state.tickers) if ticker not in previous],
+                removed=previous - current
+            )
+    if 'data_needs_refresh' not in st.session_state:
+        st.session_state.data_needs_refresh = False
+
     # Fetch data if needed
     if st.session_state.data_needs_refresh:
         fetch_data()
 
-    # Ensure numerical columns are of numeric data types
-    numerical_columns = [
-        'PE Ratio',
-        'PEG Ratio',
-        'Price-to-Sales Ratio',
-        'Forward PE',
-        'Price-to-Book Ratio',
-        'EV/EBITDA Ratio',
-        'Dividend Yield (%)',
-        'Return on Equity (%)',
-        'Earnings Per Share ($)',
-        'Debt-to-Equity Ratio',
-        'Profit Margin (%)',
-        'Beta'
-    ]
-
+    # Pick up snapshots the background refresher has written since the table was built
+    snapshot_times = {}
     if not st.session_state.metrics_df.empty:
-        for col in numerical_columns:
-            st.session_state.metrics_df[col] = pd.to_numeric(st.session_state.metrics_df[col], errors='coerce')
-
-        # Proceed to create the Styler object and apply conditional formatting
-        metrics_df = st.session_state.metrics_df.set_index('Ticker')
-
-        # Define formatting for columns
-        format_dict = {
-            'Current Price ($)': '${:,.2f}',
-            'PE Ratio': '{:.2f}',
-            'PEG Ratio': '{:.2f}',
-            'Price-to-Sales Ratio': '{:.2f}',
-            'Forward PE': '{:.2f}',
-            'Price-to-Book Ratio': '{:.2f}',
-            'EV/EBITDA Ratio': '{:.2f}',
-            'Dividend Yield (%)': '{:.2f}%',
-            'Return on Equity (%)': '{:.2f}%',
-            'Earnings Per Share ($)': '${:,.2f}',
-            'Debt-to-Equity Ratio': '{:.2f}',
-            'Profit Margin (%)': '{:.2f}%',
-            'Beta': '{:.2f}',
-        }
-
-        # Create a Styler object with formatting
-        styled_df = metrics_df.style.format(format_dict, na_rep='N/A')
+        snapshots = get_metrics_cache().get_many(st.session_state.metrics_df['Ticker'])
+        snapshot_times = {ticker: fetched_at for ticker, (metrics, fetched_at) in snapshots.items()}
+        previous_times = st.session_state.get('snapshot_times')
+        if previous_times not in (None, snapshot_times) and len(snapshots) == len(st.session_state.metrics_df):
+            builder = MetricsTableBuilder(capacity=len(st.session_state.metrics_df))
+            for ticker in st.session_state.metrics_df['Ticker']:
+                if ticker in snapshots:
+                    builder.append(ticker, snapshots[ticker][0])
+            set_metrics_df(builder.to_frame())
+        st.session_state.snapshot_times = snapshot_times
+    if refresher is not None:
+        refresher.watch(st.session_state.tickers)
 
-        # Apply conditional formatting
-        styled_df = styled_df.applymap(color_pe_ratio, subset=['PE Ratio'])
-        styled_df = styled_df.applymap(color_forward_pe, subset=['Forward PE'])
-        styled_df = styled_df.applymap(color_peg_ratio, subset=['PEG Ratio'])
-        styled_df = styled_df.applymap(color_pb_ratio, subset=['Price-to-Book Ratio'])
-        styled_df = styled_df.applymap(color_ps_ratio, subset=['Price-to-Sales Ratio'])
-        styled_df = styled_df.applymap(color_ev_ebitda, subset=['EV/EBITDA Ratio'])
-        styled_df = styled_df.applymap(color_dividend_yield, subset=['Dividend Yield (%)'])
-        styled_df = styled_df.applymap(color_roe, subset=['Return on Equity (%)'])
-        styled_df = styled_df.applymap(color_eps, subset=['Earnings Per Share ($)'])
-        styled_df = styled_df.applymap(color_de_ratio, subset=['Debt-to-Equity Ratio'])
-        styled_df = styled_df.applymap(color_profit_margin, subset=['Profit Margin (%)'])
-        styled_df = styled_df.applymap(color_beta, subset=['Beta'])
+    if not st.session_state.metrics_df.empty:
+        # Colour and score against fixed thresholds, or by percentile rank among
+        # industry peers (falling back to sector and universe for small groups)
+        peer_relative = st.toggle(
+            "Score relative to sector and industry peers",
+            help=f"Ranks each metric against every cached ticker in the same industry, or the same sector when the "
+                 f"industry has fewer than {MIN_PEERS} peers. The best third of peers is green, the worst third red."
+        )
+        show_indicators = st.toggle(
+            "Add technical indicators from price history",
+            help=f"Volatility over {VOLATILITY_WINDOW} trading days, max drawdown over the last year, six-month "
+                 f"momentum, distance from the 200-day average and beta against {BENCHMARK} over {BETA_WINDOW} days."
+        )
+        # The scored table is rebuilt only when the data, the peer universe
+        # or the stored price history it was built from changes, not on
+        # every rerun
+        table_key = (
+            st.session_state.metrics_hash,
+            peer_relative,
+            get_peer_index().version if peer_relative else None,
+            show_indicators,
+            get_price_history_store().version if show_indicators else None,
+        )
+        metrics_df, bands = memoized('table', table_key, lambda: build_table(peer_relative, show_indicators))
 
         # --- 1. Display Comparison Table ---
         st.header("Stock Comparison Table")
-        st.write(styled_df)
-
-        # --- 2. Export to Excel Button ---
-        def to_excel(df):
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                df.to_excel(writer, index=False, sheet_name='Stock Metrics')
-            processed_data = output.getvalue()
-            return processed_data
+        if snapshot_times:
+            st.caption(snapshot_age_caption(snapshot_times, refresher))
+        comparison_table(metrics_df, bands, table_key)
 
-        excel_data = to_excel(st.session_state.metrics_df)
-
-        st.download_button(
-            label="📥 Export data to Excel",
-            data=excel_data,
-            file_name='stock_metrics.xlsx',
-            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        # --- 2. Export Buttons ---
+        export_section()
 
         # --- 3. Refresh Data Button ---
         if st.button("Refresh Data"):
-            fetch_data()
+            fetch_data(force_refresh=True)
             st.success("Data refreshed successfully.")
 
+        # Each section below is a fragment: its widgets rerun only that section
+        st.divider()
+
+        # --- 3. Stock Screener ---
+        screener_section(metrics_df, bands)
+
         st.divider()
 
         # --- 4. Metrics Explained ---
-        st.header("Metrics Explained")
-        metric_list = list(metric_explanations.keys())
-        choice = st.selectbox(
-            "Select a Metric to Explain",
-            metric_list,
-        )
-        st.write(f"**{choice}:** {metric_explanations[choice]}")
+        explanation_section()
 
         st.divider()
 
-        # --- 5. Visualization 1: Stock Price Chart ---
-        st.header("Stock Price Over the Last Year")
+        # --- 4. Valuation Breakdown ---
+        breakdown_section(metrics_df, peer_relative)
 
-        # Dropdown to select a ticker
-        selected_ticker = st.selectbox(
-            "Select a Ticker to View Price Chart",
-            st.session_state.tickers
-        )
+        st.divider()
 
-        # Fetch historical data for the selected ticker
-        stock_obj = yf.Ticker(selected_ticker)
-        hist_data = stock_obj.history(period="1y")
-
-        if not hist_data.empty:
-            hist_data.reset_index(inplace=True)
-            fig_price = px.line(
-                hist_data,
-                x='Date',
-                y='Close',
-                title=f"{selected_ticker} Closing Price Over the Last Year",
-                labels={'Close': 'Closing Price ($)', 'Date': 'Date'}
-            )
-            st.plotly_chart(fig_price, use_container_width=True)
-        else:
-            st.warning(f"No historical data available for {selected_ticker}.")
+        # --- 5. Visualization 1: Stock Price Chart ---
+        price_chart_section()
 
         st.divider()
 
         # --- 5. Visualization 2: Metric Comparison Chart ---
-        st.header("Metric Comparison Among Selected Stocks")
-
-        # Dropdown to select a metric
-        metric_options = [
-            'PE Ratio',
-            'PEG Ratio',
-            'Price-to-Sales Ratio',
-            'Forward PE',
-            'Price-to-Book Ratio',
-            'EV/EBITDA Ratio',
-            'Dividend Yield (%)',
-            'Return on Equity (%)',
-            'Earnings Per Share ($)',
-            'Debt-to-Equity Ratio',
-            'Profit Margin (%)',
-            'Beta'
-        ]
-
-        selected_metric = st.selectbox(
-            "Select a Metric to Compare Across Stocks",
-            metric_options
-        )
+        metric_chart_section()
 
-        # Filter data for the selected metric
-        metric_data = st.session_state.metrics_df[['Ticker', selected_metric]].dropna()
+        st.divider()
 
-        if not metric_data.empty:
-            # Create a bar chart using Plotly
-            fig_metric = px.bar(
-                metric_data,
-                x='Ticker',
-                y=selected_metric,
-                title=f"Comparison of {selected_metric} Across Selected Stocks",
-                labels={'Ticker': 'Ticker', selected_metric: selected_metric}
-            )
-            st.plotly_chart(fig_metric, use_container_width=True)
-        else:
-            st.warning(f"No data available for {selected_metric}.")
+        # --- 5. Visualization 3: Metric Trend From Stored Snapshots ---
+        trend_section()
 
+        st.divider()
+
+        # --- 6. Portfolio Risk ---
+        risk_section()
     else:
         st.info("No data available to display. Please add tickers and click 'Refresh Data'.")
 
@@ -408,5 +799,11 @@ def main():
     - Examples: AAPL, MSFT, TSLA, etc.
     """)
 
+    # Optional diagnostics: where the time went in this process
+    if st.sidebar.checkbox("Show diagnostics"):
+        show_diagnostics()
+    if METRICS_FILE:
+        registry.write_prometheus(METRICS_FILE)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,75 @@
+# table_view.py
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span, inc
+
+# Tables with more rows than this are shown a page at a time
+PAGED_TABLE_ROWS = 200
+PAGE_SIZES = (25, 50, 100, 250)
+
+class TableView:
+    # Sorted, filtered and paged access to a comparison table, so only the
+    # visible rows are styled and sent to the browser. Sort orders are
+    # argsort indexes computed once per column and reused for as long as the
+    # view is: build a new view when the table changes.
+
+    def __init__(self, frame, key=None):
+        self.frame = frame
+        self.key = key
+        self.columns = [col for col in frame.columns if pd.api.types.is_numeric_dtype(frame[col])]
+        self._values = {col: frame[col].to_numpy(dtype=float, na_value=np.nan) for col in self.columns}
+        self._orders = {}
+
+    def __len__(self):
+        return len(self.frame)
+
+    def order(self, column):
+        # Row positions sorted ascending by the column, missing values last.
+        # None sorts by the index (ticker).
+        if column not in self._orders:
+            with span('table_sort'):
+                if column is None:
+                    self._orders[column] = np.argsort(self.frame.index.to_numpy(dtype=str), kind='stable')
+                else:
+                    self._orders[column] = np.argsort(self._values[column], kind='stable')
+            inc('table_sorts')
+        return self._orders[column]
+
+    def bounds(self, column):
+        # Smallest and largest finite value of a column, or None without any
+        values = self._values[column]
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return None
+        return float(values.min()), float(values.max())
+
+    def mask(self, ranges=None, search=''):
+        # Rows with every column in ranges ({column: (low, high)}, inclusive)
+        # and a ticker containing search
+        keep = np.ones(len(self.frame), dtype=bool)
+        for col, (low, high) in (ranges or {}).items():
+            values = self._values[col]
+            keep &= (values >= low) & (values <= high)
+        if search:
+            keep &= self.frame.index.str.contains(search.strip(), case=False, regex=False)
+        return keep
+
+    def rows(self, sort=None, descending=False, ranges=None, search=''):
+        # Positions of the matching rows in display order
+        order = self.order(sort)
+        if descending:
+            # Reverse the present values but keep missing ones last
+            present = len(order) if sort is None else int(np.count_nonzero(~np.isnan(self._values[sort])))
+            order = np.concatenate([order[:present][::-1], order[present:]])
+        if ranges or search:
+            order = order[self.mask(ranges, search)[order]]
+        return order
+
+    def page(self, rows, number, size):
+        # The slice of rows shown on a page, numbered from 1
+        return rows[(number - 1) * size:number * size]
+
+    def page_count(self, rows, size):
+        return max(1, -(-len(rows) // size))
@@ -0,0 +1,52 @@
+# test_screening.py
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from screening import Screen, ScreenError, run_screen, top_n
+
+def metrics_frame():
+    return pd.DataFrame({
+        'PE Ratio': [10.0, 25.0, np.nan, 15.0],
+        'Beta': [0.8, 1.4, 1.1, 2.0],
+        'Sector': ['Technology', 'Utilities', 'Technology', 'Energy'],
+    }, index=pd.Index(['AAA', 'BBB', 'CCC', 'DDD'], name='Ticker'))
+
+def tickers(expression):
+    frame = metrics_frame()
+    return list(frame.index[Screen(expression).mask(frame)])
+
+def test_comparisons_and_missing_values():
+    assert tickers('"PE Ratio" < 20') == ['AAA', 'DDD']
+    assert tickers('0.5 <= Beta <= 1.5') == ['AAA', 'BBB', 'CCC']
+    assert tickers('Sector == "Technology" and not (Beta > 1)') == ['AAA']
+
+def test_constant_operands_are_broadcast():
+    assert tickers('Beta > 1 and True') == ['BBB', 'CCC', 'DDD']
+    assert tickers('"PE Ratio" < 20 and 1') == ['AAA', 'DDD']
+    assert tickers('Beta > 1 or (1 < 2)') == ['AAA', 'BBB', 'CCC', 'DDD']
+
+def test_constant_division_by_zero():
+    assert tickers('"PE Ratio" < 1/0') == ['AAA', 'BBB', 'DDD']
+
+@pytest.mark.parametrize('expression', [
+    'Beta >',
+    'Missing > 1',
+    '"PE Ratio" < "Sector" + 1',
+    '1 < 2',
+    'Beta ** 2 > 1',
+])
+def test_invalid_expressions_raise_screen_error(expression):
+    with pytest.raises(ScreenError):
+        tickers(expression)
+
+def test_top_n_ranks_without_missing_values():
+    values = np.array([3.0, np.nan, 5.0, 1.0])
+    assert list(top_n(values, 2)) == [2, 0]
+    assert list(top_n(values, 2, largest=False)) == [3, 0]
+
+def test_run_screen_ranks_matches():
+    frame = metrics_frame()
+    rows = run_screen(frame, 'Beta > 1', rank_by='Beta', n=2, largest=True)
+    assert list(frame.index[rows]) == ['DDD', 'BBB']
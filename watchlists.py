@@ -0,0 +1,29 @@
+# watchlists.py
+
+import os
+
+# List of AI stock tickers shown when a session starts
+DEFAULT_TICKERS = [
+    'NVDA', 'GOOGL', 'MSFT', 'AMZN', 'IBM', 'TSLA', 'META', 'BIDU',
+    'AMD', 'CRM', 'INTC', 'ORCL', 'TWLO', 'PLTR', 'AI', 'PATH',
+    'CGNX'
+]
+
+# Ticker files kept warm by the background refresher, separated by os.pathsep
+WATCHLISTS = [path for path in os.environ.get('AI_FUND_WATCHLISTS', '').split(os.pathsep) if path]
+
+def read_tickers(path):
+    # One or more tickers per line, separated by commas or whitespace; '#' starts a comment
+    tickers = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0]
+            tickers.extend(token.upper() for token in line.replace(',', ' ').split())
+    return list(dict.fromkeys(tickers))
+
+def configured_tickers(paths=None):
+    # The default tickers followed by every configured watchlist
+    tickers = list(DEFAULT_TICKERS)
+    for path in WATCHLISTS if paths is None else paths:
+        tickers.extend(read_tickers(path))
+    return list(dict.fromkeys(tickers))